@@ -0,0 +1,111 @@
+# backend/answer_cache.py
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") == "1"
+# Cosine similarity a new question needs with a cached one to reuse its answer
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "2000"))
+
+
+class AnswerCache:
+    """
+    Answers to earlier questions, keyed by (document hash, web search flag) and
+    matched by query embedding similarity. Entries expire after ttl_seconds and
+    the least recently used ones are evicted beyond max_entries.
+    """
+
+    def __init__(self, threshold: float, ttl_seconds: int, max_entries: int):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # entry id -> entry, least recently used first
+        self._namespaces = {}  # (doc hash, search_web) -> entry ids
+        self._next_id = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id)
+        ids = self._namespaces[entry["namespace"]]
+        ids.remove(entry_id)
+        if not ids:
+            del self._namespaces[entry["namespace"]]
+
+    def lookup(self, doc_hash: str, search_web: bool, query_vector):
+        """Returns the cached {"question", "answer", "metadata"} of the most similar question, or None."""
+        namespace = (doc_hash, bool(search_web))
+        query_vector = self._normalize(query_vector)
+        with self._lock:
+            now = time.time()
+            for entry_id in [i for i in self._namespaces.get(namespace, [])
+                             if now - self._entries[i]["created_at"] > self.ttl_seconds]:
+                self._remove(entry_id)
+
+            ids = self._namespaces.get(namespace)
+            if not ids:
+                self.misses += 1
+                return None
+            scores = np.vstack([self._entries[i]["vector"] for i in ids]) @ query_vector
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            entry_id = ids[best]
+            self._entries.move_to_end(entry_id)
+            entry = self._entries[entry_id]
+            print(f"[ANSWER CACHE] Hit (similarity {scores[best]:.3f}) for '{entry['question'][:60]}'")
+            return {"question": entry["question"], "answer": entry["answer"], "metadata": entry["metadata"]}
+
+    def store(self, doc_hash: str, search_web: bool, query_vector, question: str, answer: str, metadata: dict):
+        namespace = (doc_hash, bool(search_web))
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = {
+                "namespace": namespace,
+                "vector": self._normalize(query_vector),
+                "question": question,
+                "answer": answer,
+                "metadata": metadata,
+                "created_at": time.time(),
+            }
+            self._namespaces.setdefault(namespace, []).append(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "documents": len({doc_hash for doc_hash, _ in self._namespaces}),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "threshold": self.threshold,
+            }
+
+
+answer_cache = AnswerCache(ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_MAX_ENTRIES)
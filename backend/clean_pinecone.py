@@ -4,7 +4,9 @@ from dotenv import load_dotenv
 
 def clear_pinecone_index():
     """
-    Deletes all vectors from the specified Pinecone index.
+    Deletes all vectors from the specified Pinecone index, and the vector
+    manifest with them. To remove only orphaned vectors, use
+    `python vector_manifest.py vacuum` instead.
     """
     load_dotenv()
 
@@ -35,6 +37,15 @@ def clear_pinecone_index():
         index.delete(delete_all=True)
         
         print(f"Successfully deleted all vectors from index '{INDEX_NAME}'.")
+
+        # Otherwise re-ingestion would skip chunks the manifest still lists as stored
+        import database
+        db = database.SessionLocal()
+        try:
+            db.query(database.DocumentVector).delete()
+            db.commit()
+        finally:
+            db.close()
         
         # You can check the vector count to confirm
         stats = index.describe_index_stats()
@@ -1,6 +1,6 @@
 # backend/database.py
 
-from sqlalchemy import create_engine, Column, Integer, String, DateTime
+from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import datetime
@@ -26,6 +26,36 @@ class Document(Base):
     id = Column(Integer, primary_key=True, index=True)
     filename = Column(String, index=True)
     upload_date = Column(DateTime, default=datetime.datetime.utcnow)
+    # sha256 of the uploaded bytes, used to skip re-ingesting identical files
+    content_hash = Column(String(64), index=True)
+    # Set once ingestion has finished; NULL while processing or after a failure
+    chunk_count = Column(Integer)
+
+class ChatSession(Base):
+    __tablename__ = "chat_sessions"
+
+    session_id = Column(String(64), primary_key=True)
+    # JSON-encoded conversation state (chat history and active document)
+    state = Column(Text, nullable=False)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+
+class IngestionJob(Base):
+    __tablename__ = "ingestion_jobs"
+
+    job_id = Column(String(32), primary_key=True)
+    # JSON-encoded public job fields (status and progress counters)
+    state = Column(Text, nullable=False)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+
+class DocumentVector(Base):
+    __tablename__ = "document_vectors"
+
+    # Manifest of the vectors stored for each file_id, so stale ones can be found and deleted
+    vector_id = Column(String(320), primary_key=True)
+    file_id = Column(String, nullable=False, index=True)
+    # sha256 of the vector's metadata without its text; re-upserted when it changes
+    metadata_hash = Column(String(64), nullable=False)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
 
 # NOTE: We will let Alembic handle table creation, so Base.metadata.create_all is removed.
 
@@ -1,63 +1,336 @@
 import fitz  # PyMuPDF
 import os
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+import re
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
 
-def process_pdf(file_path: str):
+# Documents shorter than this are always parsed serially
+PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "16"))
+# Smallest page range handed to a single worker
+MIN_PAGES_PER_SHARD = int(os.getenv("PDF_MIN_PAGES_PER_SHARD", "4"))
+# "lazy" only records which pages have images and renders them on first VLM use
+# (see page_renderer.py); "eager" renders every image page during ingestion
+PAGE_RENDER_MODE = os.getenv("PAGE_RENDER_MODE", "lazy")
+RENDER_DPI = 300
+
+# Chunks are built from layout blocks (headings, paragraphs, tables) and may
+# span page boundaries. A chunk is closed once it reaches CHUNK_TARGET_CHARS;
+# single blocks longer than CHUNK_MAX_CHARS are split on their own.
+CHUNK_TARGET_CHARS = int(os.getenv("CHUNK_TARGET_CHARS", "1000"))
+CHUNK_MAX_CHARS = int(os.getenv("CHUNK_MAX_CHARS", "1500"))
+CHUNK_MIN_CHARS = 200
+# Table detection finds tables and keeps each one in its own chunk; it costs some parse time
+DETECT_TABLES = os.getenv("PDF_DETECT_TABLES", "1") == "1"
+# A short block at least this much larger than the page's body text is a heading
+HEADING_SIZE_RATIO = 1.15
+HEADING_MAX_CHARS = 150
+# Running page numbers ("12", "Page 3 of 10") carry no content
+_PAGE_NUMBER_PATTERN = re.compile(r"^(page\s*)?\d+(\s*(of|/)\s*\d+)?$", re.IGNORECASE)
+
+# One splitter per process, reused for every oversized block that process handles
+_text_splitter = None
+
+def _get_text_splitter():
+    global _text_splitter
+    if _text_splitter is None:
+        # Imported here: langchain is slow to import and only parsing needs it
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+        _text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=CHUNK_TARGET_CHARS,
+            chunk_overlap=0,
+            length_function=len
+        )
+    return _text_splitter
+
+def chunk_content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+def chunk_vector_id(file_id: str, chunk: dict) -> str:
     """
-    Extracts text from each page. If a page contains images, it saves a
-    snapshot of the entire page and marks chunks as having visual content.
+    Vector id of a chunk, derived from its content rather than its position, so
+    unchanged chunks keep their id when a document is re-ingested.
     """
-    print(f"Processing file: {file_path}")
-    
-    image_dir = os.path.join(os.path.dirname(file_path), "images")
-    if not os.path.exists(image_dir):
-        os.makedirs(image_dir)
-
-    doc = fitz.open(file_path)
-    chunks_with_metadata = []
-    
-    for page_num, page in enumerate(doc):
-        page_text = page.get_text()
-        has_images = False
-        
-        # Check if the page has any images
-        if page.get_images(full=True):
-            has_images = True
-            # Render the entire page as a high-quality image (pixmap)
-            pix = page.get_pixmap(dpi=300)
-            image_filename = f"page_{page_num + 1}.png"
-            image_path = os.path.join(image_dir, image_filename)
-            pix.save(image_path)
-            
-            # DON'T add generic image reference text that pollutes embeddings
-            # Instead, we'll use metadata to track this
-
-        # Skip chunking if page is mostly empty
-        if len(page_text.strip()) < 50 and not has_images:
+    return f"{file_id}-{chunk.get('content_hash') or chunk_content_hash(chunk['text'])}"
+
+def count_pages(file_path: str) -> int:
+    """Returns the number of pages in the PDF without parsing its content."""
+    with fitz.open(file_path) as doc:
+        return doc.page_count
+
+def _default_image_dir(file_path: str) -> str:
+    # Stand-alone use: renders go to an "images" folder next to the PDF
+    return os.path.join(os.path.dirname(file_path), "images")
+
+def page_image_path(image_dir: str, page_number: int) -> str:
+    """Path of the rendered snapshot of a (1-based) page inside an image directory."""
+    return os.path.join(image_dir, f"page_{int(page_number)}.png")
+
+def image_regions_path(image_path: str) -> str:
+    """Sidecar file holding the image bounding boxes of a rendered page."""
+    return os.path.splitext(image_path)[0] + ".json"
+
+def _save_image_regions(page, images: list, image_path: str):
+    """
+    Records where the page's images sit (in PDF points) next to its render, so
+    the VLM can be sent just those regions instead of the whole page.
+    """
+    rects = []
+    for image in images:
+        for rect in page.get_image_rects(image[0]):
+            if not rect.is_empty:
+                rects.append([rect.x0, rect.y0, rect.x1, rect.y1])
+    regions = {"page_size": [page.rect.width, page.rect.height], "image_rects": rects}
+    with open(image_regions_path(image_path), "w") as f:
+        json.dump(regions, f)
+
+def _render_page_image(page, image_path: str):
+    """Renders the entire page as a high-quality image (pixmap) plus its image regions sidecar."""
+    pix = page.get_pixmap(dpi=RENDER_DPI)
+    pix.save(image_path)
+    _save_image_regions(page, page.get_images(full=True), image_path)
+
+def render_page(file_path: str, page_number: int, image_dir: str = None) -> str:
+    """Renders a single (1-based) page of the PDF on demand and returns the image path."""
+    image_dir = image_dir or _default_image_dir(file_path)
+    os.makedirs(image_dir, exist_ok=True)
+    image_path = page_image_path(image_dir, page_number)
+    with fitz.open(file_path) as doc:
+        _render_page_image(doc[int(page_number) - 1], image_path)
+    return image_path
+
+def _block_text(block: dict) -> tuple:
+    """Returns the text of a layout block, its largest font size and whether it is all bold."""
+    lines = []
+    max_size = 0.0
+    all_bold = True
+    for line in block["lines"]:
+        text = "".join(span["text"] for span in line["spans"]).strip()
+        if not text:
             continue
+        for span in line["spans"]:
+            if span["text"].strip():
+                max_size = max(max_size, span["size"])
+                all_bold = all_bold and bool(span["flags"] & 16)
+        # Re-join words hyphenated at the end of a line
+        if lines and lines[-1].endswith("-") and text[:1].islower():
+            lines[-1] = lines[-1][:-1] + text
+        else:
+            lines.append(text)
+    return " ".join(lines), max_size, all_bold and bool(lines)
 
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len
+def _body_font_size(text_blocks: list) -> float:
+    """The font size most of the page's text is set in."""
+    weights = {}
+    for text, size, _, _ in text_blocks:
+        weights[round(size, 1)] = weights.get(round(size, 1), 0) + len(text)
+    return max(weights, key=weights.get) if weights else 0.0
+
+def _table_text(table) -> str:
+    try:
+        return table.to_markdown().strip()
+    except Exception:
+        rows = table.extract()
+        return "\n".join(" | ".join(cell or "" for cell in row) for row in rows).strip()
+
+def _page_blocks(page, page_num: int, image_dir: str) -> dict:
+    """
+    Extracts the layout blocks of a single page in reading order, each one a
+    heading, paragraph or table, and flags whether the page contains images.
+    In eager render mode, image pages are also rendered here.
+    """
+    has_images = bool(page.get_images(full=True))
+    if has_images and PAGE_RENDER_MODE == "eager":
+        _render_page_image(page, page_image_path(image_dir, page_num + 1))
+
+    tables = []
+    if DETECT_TABLES:
+        try:
+            tables = [(fitz.Rect(table.bbox), _table_text(table)) for table in page.find_tables().tables]
+        except Exception as e:
+            print(f"Table detection failed on page {page_num + 1}: {e}")
+
+    text_blocks = []
+    for block in page.get_text("dict", flags=fitz.TEXTFLAGS_TEXT)["blocks"]:
+        if block["type"] != 0:
+            continue
+        rect = fitz.Rect(block["bbox"])
+        # Text inside a table is already part of the table's block
+        if any(table_rect.intersects(rect) for table_rect, _ in tables):
+            continue
+        text, size, bold = _block_text(block)
+        if text and not _PAGE_NUMBER_PATTERN.match(text):
+            text_blocks.append((text, size, bold, rect.y0))
+
+    body_size = _body_font_size(text_blocks)
+    blocks = []
+    pending_tables = sorted((rect.y0, text) for rect, text in tables if text)
+    for text, size, bold, y0 in text_blocks:
+        while pending_tables and pending_tables[0][0] <= y0:
+            blocks.append({'kind': 'table', 'text': pending_tables.pop(0)[1]})
+        is_heading = (
+            len(text) <= HEADING_MAX_CHARS
+            and not text.endswith(".")
+            and (size >= body_size * HEADING_SIZE_RATIO or bold)
         )
-        
-        chunks = text_splitter.split_text(text=page_text)
-        
-        # If no text but has images, create a minimal chunk
-        if not chunks and has_images:
-            chunks = [f"Page {page_num + 1} contains visual content."]
-        
-        for chunk in chunks:
-            chunks_with_metadata.append({
-                'text': chunk,
-                'page_number': page_num + 1,
-                'has_images': has_images  # Track this in metadata
-            })
+        blocks.append({'kind': 'heading' if is_heading else 'paragraph', 'text': text})
+    blocks.extend({'kind': 'table', 'text': text} for _, text in pending_tables)
+
+    return {'page_number': page_num + 1, 'has_images': has_images, 'blocks': blocks}
+
+def extract_page_blocks(file_path: str, start: int, end: int, image_dir: str = None) -> list:
+    """
+    Extracts the layout blocks of pages [start, end) of the PDF. Opens its own
+    document so it can run in a separate worker process. Eager page renders go
+    to image_dir.
+    """
+    image_dir = image_dir or _default_image_dir(file_path)
+    if PAGE_RENDER_MODE == "eager":
+        os.makedirs(image_dir, exist_ok=True)
+    with fitz.open(file_path) as doc:
+        return [_page_blocks(doc[page_num], page_num, image_dir) for page_num in range(start, end)]
+
+def build_chunks(pages: list) -> list:
+    """
+    Groups the layout blocks of consecutive pages (as returned by
+    extract_page_blocks, in page order) into chunks. Headings start a new
+    chunk and are repeated at the top of later chunks of their section, tables
+    get chunks of their own, and paragraphs flow across page boundaries. Each
+    chunk records the pages it spans (page_number to page_end), whether any
+    of them has images, and a hash of its content.
+    """
+    image_pages = {page['page_number'] for page in pages if page['has_images']}
+    chunks = []
+    seen_hashes = set()
+    heading = None
+    current = {'parts': [], 'first_page': None, 'last_page': None, 'length': 0, 'has_body': False}
+
+    def emit(text: str, first_page: int, last_page: int):
+        content_hash = chunk_content_hash(text)
+        # Repeated boilerplate (running headers, disclaimers) is only stored once
+        if content_hash in seen_hashes:
+            return
+        seen_hashes.add(content_hash)
+        chunk = {
+            'text': text,
+            'page_number': first_page,
+            'page_end': last_page,
+            'has_images': False,
+            'content_hash': content_hash,
+        }
+        pages_with_images = [p for p in range(first_page, last_page + 1) if p in image_pages]
+        if pages_with_images:
+            chunk['has_images'] = True
+            chunk['image_page'] = pages_with_images[0]
+        chunks.append(chunk)
+
+    def add(text: str, page_number: int, is_body: bool = True):
+        if current['first_page'] is None:
+            current['first_page'] = page_number
+        current['last_page'] = page_number
+        current['parts'].append(text)
+        current['length'] += len(text) + 1
+        current['has_body'] = current['has_body'] or is_body
+
+    def flush(final: bool = False):
+        # A heading with nothing under it yet stays with the content that follows
+        if current['parts'] and (current['has_body'] or final):
+            emit("\n".join(current['parts']), current['first_page'], current['last_page'])
+        if current['has_body'] or final:
+            current.update(parts=[], first_page=None, last_page=None, length=0, has_body=False)
+
+    def start_section_chunk(page_number: int):
+        if heading and not current['parts']:
+            add(heading, page_number, is_body=False)
+
+    for page in pages:
+        page_number = page['page_number']
+        if not page['blocks'] and page['has_images']:
+            # Keep image-only pages retrievable so visual questions can find them
+            emit(f"Page {page_number} contains visual content.", page_number, page_number)
+            continue
+
+        for block in page['blocks']:
+            text = block['text']
+            if block['kind'] == 'heading':
+                flush()
+                heading = text
+                add(text, page_number, is_body=False)
+            elif block['kind'] == 'table' or len(text) > CHUNK_MAX_CHARS:
+                flush()
+                pieces = [text] if len(text) <= CHUNK_MAX_CHARS else _get_text_splitter().split_text(text)
+                for piece in pieces:
+                    start_section_chunk(page_number)
+                    add(piece, page_number)
+                    flush()
+            else:
+                if current['has_body'] and current['length'] + len(text) > CHUNK_TARGET_CHARS \
+                        and current['length'] >= CHUNK_MIN_CHARS:
+                    flush()
+                start_section_chunk(page_number)
+                add(text, page_number)
+    flush(final=True)
+    return chunks
+
+def process_page_range(file_path: str, start: int, end: int, image_dir: str = None) -> list:
+    """
+    Chunks pages [start, end) of the PDF on their own. Chunks cannot span past
+    the range; process_pdf and ingestion chunk the blocks of the whole document.
+    """
+    return build_chunks(extract_page_blocks(file_path, start, end, image_dir))
+
+def split_page_ranges(page_count: int, workers: int) -> list:
+    """
+    Splits the document into contiguous (start, end) page ranges. Creates a few
+    more shards than workers so that pages heavy on images don't leave cores idle.
+    """
+    if page_count <= 0:
+        return []
+    shards = max(1, min(workers * 4, page_count // MIN_PAGES_PER_SHARD))
+    size, remainder = divmod(page_count, shards)
+    ranges = []
+    start = 0
+    for i in range(shards):
+        end = start + size + (1 if i < remainder else 0)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+def process_pdf(file_path: str, parallel: bool = False, max_workers: int = None, image_dir: str = None):
+    """
+    Extracts the layout blocks of each page and groups them into chunks that
+    may span pages. Chunks on pages with images are marked as having visual
+    content and, in eager render mode, a snapshot of the entire page is saved.
+
+    With parallel=True, block extraction is sharded across a process pool by
+    page range; the blocks are merged back in page order before chunking.
+    """
+    print(f"Processing file: {file_path}")
+
+    page_count = count_pages(file_path)
+    max_workers = max_workers or os.cpu_count() or 1
+
+    if parallel and max_workers > 1 and page_count >= PARALLEL_MIN_PAGES:
+        ranges = split_page_ranges(page_count, max_workers)
+        print(f"Parsing {page_count} pages in {len(ranges)} shards across {max_workers} workers...")
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            # map() yields results in submission order, which is page order
+            results = executor.map(
+                extract_page_blocks,
+                [file_path] * len(ranges),
+                [start for start, _ in ranges],
+                [end for _, end in ranges],
+                [image_dir] * len(ranges),
+            )
+            pages = [page for shard in results for page in shard]
+    else:
+        pages = extract_page_blocks(file_path, 0, page_count, image_dir)
 
+    chunks_with_metadata = build_chunks(pages)
     if not chunks_with_metadata:
         print("Could not extract text from PDF.")
         return []
 
     print(f"Successfully processed and split file into {len(chunks_with_metadata)} chunks.")
-    return chunks_with_metadata
\ No newline at end of file
+    return chunks_with_metadata
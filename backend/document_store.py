@@ -0,0 +1,41 @@
+# backend/document_store.py
+
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Uploaded PDFs and their page renders are stored by document id (the sha256 of
+# the file content), so documents with the same filename never overwrite each
+# other:
+#   uploads/documents/<doc_id>.pdf
+#   uploads/images/<doc_id>/page_<n>.png
+#   uploads/indexes/<doc_id>.bm25.json
+UPLOAD_DIRECTORY = os.getenv("UPLOAD_DIRECTORY", "./uploads")
+DOCUMENTS_DIRECTORY = os.path.join(UPLOAD_DIRECTORY, "documents")
+IMAGES_DIRECTORY = os.path.join(UPLOAD_DIRECTORY, "images")
+INDEXES_DIRECTORY = os.path.join(UPLOAD_DIRECTORY, "indexes")
+
+for directory in (UPLOAD_DIRECTORY, DOCUMENTS_DIRECTORY, IMAGES_DIRECTORY, INDEXES_DIRECTORY):
+    os.makedirs(directory, exist_ok=True)
+
+
+def document_path(doc_id: str) -> str:
+    """Path of the stored PDF for a document id."""
+    return os.path.join(DOCUMENTS_DIRECTORY, f"{doc_id}.pdf")
+
+
+def image_dir(doc_id: str) -> str:
+    """Directory holding the page renders of a document."""
+    return os.path.join(IMAGES_DIRECTORY, doc_id)
+
+
+def sparse_index_path(doc_id: str) -> str:
+    """Path of the BM25 index built from a document's chunks."""
+    return os.path.join(INDEXES_DIRECTORY, f"{doc_id}.bm25.json")
+
+
+def list_image_namespaces() -> list:
+    """Document ids that currently have a page render directory."""
+    return [entry.name for entry in os.scandir(IMAGES_DIRECTORY) if entry.is_dir()]
@@ -0,0 +1,284 @@
+# backend/embedding_backends.py
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Exported ONNX models (fp32 and int8) and their tokenizers, per model name
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "./cache/onnx")
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", "0"))  # 0 lets ONNX Runtime decide
+ONNX_MAX_SEQ_LENGTH = 128  # matches the SentenceTransformer's max_seq_length for MiniLM
+# An ONNX backend must agree with the PyTorch model at least this much on every sample
+PARITY_MIN_COSINE = float(os.getenv("EMBED_PARITY_MIN_COSINE", "0.98"))
+
+BACKEND_NAMES = ("torch", "onnx", "onnx-int8")
+
+SAMPLE_TEXTS = [
+    "What was the total revenue in 2023?",
+    "Summarize the key findings of this report.",
+    "The chart on page 3 shows customer satisfaction scores by region.",
+    "Employee headcount grew from 4,512 to 5,130 over the fiscal year.",
+    "Barriers to adoption include cost, lack of training and unclear regulation.",
+    "Tell me about this document.",
+    "Operating margin declined by 1.5 percentage points due to higher input costs.",
+    "Respondents rated ease of use 4.2 out of 5 on average.",
+]
+
+
+class TorchEmbeddingBackend:
+    """The reference SentenceTransformer model on PyTorch."""
+
+    name = "torch"
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name)
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts: list) -> np.ndarray:
+        return np.asarray(self.model.encode(texts), dtype=np.float32)
+
+
+class OnnxEmbeddingBackend:
+    """
+    The same model exported to ONNX (see `python embedding_backends.py export`)
+    and run with ONNX Runtime, optionally int8 dynamically quantized. Needs only
+    onnxruntime and tokenizers at runtime, not PyTorch.
+    """
+
+    def __init__(self, model_name: str, quantized: bool, verify_parity: bool = True):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        self.name = "onnx-int8" if quantized else "onnx"
+        directory = onnx_model_dir(model_name)
+        model_path = os.path.join(directory, "model.int8.onnx" if quantized else "model.onnx")
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(
+                f"No exported ONNX model at {model_path}. Run 'python embedding_backends.py export' first."
+            )
+
+        options = onnxruntime.SessionOptions()
+        if ONNX_THREADS:
+            options.intra_op_num_threads = ONNX_THREADS
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(directory, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=ONNX_MAX_SEQ_LENGTH)
+        pad_id = self.tokenizer.token_to_id("[PAD]")
+        self.tokenizer.enable_padding(pad_id=pad_id or 0, pad_token="[PAD]")
+
+        with open(os.path.join(directory, "export.json")) as f:
+            export = json.load(f)
+        self.dim = export["dim"]
+        parity = export.get("parity", {}).get(self.name)
+        if verify_parity and parity is None:
+            print(f"[EMBED] Warning: no parity check recorded for {self.name}; run 'python embedding_backends.py parity'")
+        elif verify_parity and not parity["passed"]:
+            raise RuntimeError(
+                f"{self.name} embeddings disagree with PyTorch (min cosine {parity['min_cosine']}); "
+                f"use EMBEDDING_BACKEND=torch or re-export."
+            )
+
+    def encode(self, texts: list) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+
+        token_embeddings = self.session.run(None, feeds)[0]
+        # Mean pooling over real tokens, as the SentenceTransformer's pooling layer does
+        mask = attention_mask[:, :, None].astype(np.float32)
+        summed = (token_embeddings * mask).sum(axis=1)
+        return (summed / np.clip(mask.sum(axis=1), 1e-9, None)).astype(np.float32)
+
+
+def onnx_model_dir(model_name: str) -> str:
+    return os.path.join(ONNX_MODEL_DIR, model_name.replace("/", "__"))
+
+
+def create_embedding_backend(name: str, model_name: str):
+    """Creates the embedding backend selected by name ("torch", "onnx" or "onnx-int8")."""
+    if name == "torch":
+        return TorchEmbeddingBackend(model_name)
+    if name in ("onnx", "onnx-int8"):
+        return OnnxEmbeddingBackend(model_name, quantized=name == "onnx-int8")
+    raise ValueError(f"Unknown EMBEDDING_BACKEND '{name}'. Use one of {', '.join(BACKEND_NAMES)}.")
+
+
+def export_onnx(model_name: str):
+    """
+    Exports the transformer of the SentenceTransformer model to ONNX and writes
+    an int8 dynamically quantized copy next to it. Needs PyTorch, so run it once
+    at build time rather than on every worker.
+    """
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from sentence_transformers import SentenceTransformer
+
+    directory = onnx_model_dir(model_name)
+    os.makedirs(directory, exist_ok=True)
+    reference = SentenceTransformer(model_name, device="cpu")
+    transformer = reference[0].auto_model.eval()
+    tokenizer = reference.tokenizer
+    tokenizer.save_pretrained(directory)  # writes tokenizer.json for the runtime
+
+    sample = tokenizer(["export sample"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["token_embeddings"] = {0: "batch", 1: "sequence"}
+
+    model_path = os.path.join(directory, "model.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            tuple(sample[name] for name in input_names),
+            model_path,
+            input_names=input_names,
+            output_names=["token_embeddings"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+        )
+    quantize_dynamic(model_path, os.path.join(directory, "model.int8.onnx"), weight_type=QuantType.QInt8)
+
+    with open(os.path.join(directory, "export.json"), "w") as f:
+        json.dump({"model_name": model_name, "dim": reference.get_sentence_embedding_dimension()}, f)
+    print(f"Exported {model_name} to {directory} (model.onnx, model.int8.onnx)")
+
+
+def _cosine_rows(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return (a * b).sum(axis=1)
+
+
+def check_parity(model_name: str, texts: list = None, min_cosine: float = PARITY_MIN_COSINE) -> dict:
+    """
+    Compares each ONNX backend with the PyTorch model on the same texts.
+    Returns {backend: {"min_cosine", "mean_cosine", "passed"}}.
+    """
+    texts = texts or SAMPLE_TEXTS
+    reference = TorchEmbeddingBackend(model_name).encode(texts)
+    results = {}
+    for name in ("onnx", "onnx-int8"):
+        backend = OnnxEmbeddingBackend(model_name, quantized=name == "onnx-int8", verify_parity=False)
+        cosines = _cosine_rows(reference, backend.encode(texts))
+        results[name] = {
+            "min_cosine": round(float(cosines.min()), 4),
+            "mean_cosine": round(float(cosines.mean()), 4),
+            "passed": bool(cosines.min() >= min_cosine),
+        }
+    return results
+
+
+def record_parity(model_name: str, results: dict):
+    """Stores parity results with the export, so workers refuse a backend that failed."""
+    path = os.path.join(onnx_model_dir(model_name), "export.json")
+    with open(path) as f:
+        export = json.load(f)
+    export["parity"] = results
+    with open(path, "w") as f:
+        json.dump(export, f)
+
+
+def _benchmark_one(name: str, model_name: str, texts: list, batch_size: int) -> dict:
+    import resource
+
+    def peak_rss_mb():
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # kB on Linux
+
+    before = peak_rss_mb()
+    started = time.perf_counter()
+    backend = create_embedding_backend(name, model_name)
+    load_seconds = time.perf_counter() - started
+
+    backend.encode(texts[:batch_size])  # warm-up
+    started = time.perf_counter()
+    for i in range(0, len(texts), batch_size):
+        backend.encode(texts[i:i + batch_size])
+    elapsed = time.perf_counter() - started
+    return {
+        "backend": name,
+        "docs_per_second": round(len(texts) / elapsed, 1),
+        "load_seconds": round(load_seconds, 2),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "model_rss_mb": round(peak_rss_mb() - before, 1),
+    }
+
+
+def benchmark(model_name: str, texts: list, batch_size: int = 64, backends=BACKEND_NAMES) -> list:
+    """
+    Measures docs/sec and memory of each backend, each in a fresh interpreter
+    so one backend's imports and arenas don't count against another.
+    """
+    results = []
+    for name in backends:
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "_bench-one", name, model_name, str(batch_size)],
+            input=json.dumps(texts), capture_output=True, text=True,
+        )
+        if completed.returncode != 0:
+            print(f"Benchmark of {name} failed: {completed.stderr.strip().splitlines()[-1:]}")
+            continue
+        results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    return results
+
+
+def _benchmark_texts(pdf_path: str = None, count: int = 512) -> list:
+    if pdf_path:
+        from document_processor import process_pdf
+
+        texts = [chunk['text'] for chunk in process_pdf(pdf_path)]
+    else:
+        texts = SAMPLE_TEXTS
+    return (texts * (count // len(texts) + 1))[:count]
+
+
+if __name__ == "__main__":
+    from vector_store import MODEL_NAME
+
+    parser = argparse.ArgumentParser(description="Manage and compare embedding backends.")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    subcommands.add_parser("export", help="Export the model to ONNX and quantize it to int8.")
+    parity_parser = subcommands.add_parser("parity", help="Compare the ONNX backends with PyTorch.")
+    parity_parser.add_argument("--min-cosine", type=float, default=PARITY_MIN_COSINE)
+    bench_parser = subcommands.add_parser("benchmark", help="Measure docs/sec and memory of each backend.")
+    bench_parser.add_argument("--pdf", help="Embed the chunks of this PDF instead of built-in samples.")
+    bench_parser.add_argument("--count", type=int, default=512)
+    bench_parser.add_argument("--batch-size", type=int, default=64)
+    one_parser = subcommands.add_parser("_bench-one")
+    one_parser.add_argument("name")
+    one_parser.add_argument("model_name")
+    one_parser.add_argument("batch_size", type=int)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_onnx(MODEL_NAME)
+    if args.command in ("export", "parity"):
+        results = check_parity(MODEL_NAME, min_cosine=getattr(args, "min_cosine", PARITY_MIN_COSINE))
+        record_parity(MODEL_NAME, results)
+        for name, result in results.items():
+            print(f"{name:10} min cosine {result['min_cosine']:.4f}  mean {result['mean_cosine']:.4f}  "
+                  f"{'OK' if result['passed'] else 'FAILED'}")
+        sys.exit(0 if all(result["passed"] for result in results.values()) else 1)
+    elif args.command == "benchmark":
+        texts = _benchmark_texts(args.pdf, args.count)
+        print(f"{'backend':10} {'docs/s':>8} {'load s':>7} {'model MB':>9} {'peak MB':>8}")
+        for result in benchmark(MODEL_NAME, texts, args.batch_size):
+            print(f"{result['backend']:10} {result['docs_per_second']:8.1f} {result['load_seconds']:7.2f} "
+                  f"{result['model_rss_mb']:9.1f} {result['peak_rss_mb']:8.1f}")
+    elif args.command == "_bench-one":
+        texts = json.loads(sys.stdin.read())
+        print(json.dumps(_benchmark_one(args.name, args.model_name, texts, args.batch_size)))
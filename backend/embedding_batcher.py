@@ -0,0 +1,116 @@
+# backend/embedding_batcher.py
+
+import asyncio
+import os
+import queue
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# A batch is encoded once it has QUERY_EMBED_MAX_BATCH queries or
+# QUERY_EMBED_WINDOW_MS have passed since its first query arrived
+QUERY_EMBED_MAX_BATCH = int(os.getenv("QUERY_EMBED_MAX_BATCH", "32"))
+QUERY_EMBED_WINDOW_MS = float(os.getenv("QUERY_EMBED_WINDOW_MS", "5"))
+
+_STOP = object()
+
+
+class QueryEmbeddingBatcher:
+    """
+    Groups query embeddings from concurrent requests into batched forward passes.
+
+    Callers await embed(text) on the event loop; a dedicated thread collects the
+    queued texts into micro-batches, encodes each batch with a single call to
+    encode_fn and resolves the callers' futures.
+    """
+
+    def __init__(self, encode_fn, max_batch: int, window_ms: float):
+        self.encode_fn = encode_fn
+        self.max_batch = max_batch
+        self.window_seconds = window_ms / 1000
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.queries = 0
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="query-embedder", daemon=True)
+                    self._thread.start()
+
+    async def embed(self, text: str):
+        """Returns the embedding of text, encoded together with any queries queued alongside it."""
+        self._ensure_started()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.put((text, loop, future))
+        return await future
+
+    def _collect_batch(self, first) -> list:
+        batch = [first]
+        window_end = time.monotonic() + self.window_seconds
+        while len(batch) < self.max_batch:
+            timeout = window_end - time.monotonic()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                # Finish this batch, then stop
+                self._queue.put(_STOP)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+            batch = self._collect_batch(first)
+
+            # Identical queries in one batch are encoded once
+            texts = list(dict.fromkeys(text for text, _, _ in batch))
+            try:
+                vectors = dict(zip(texts, self.encode_fn(texts)))
+                error = None
+            except Exception as e:
+                print(f"[EMBED] Batch of {len(texts)} queries failed: {e}")
+                vectors, error = None, e
+
+            self.batches += 1
+            self.queries += len(batch)
+            for text, loop, future in batch:
+                if error is None:
+                    loop.call_soon_threadsafe(_resolve, future, vectors[text], None)
+                else:
+                    loop.call_soon_threadsafe(_resolve, future, None, error)
+
+    def shutdown(self):
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "queries": self.queries,
+            "average_batch_size": round(self.queries / self.batches, 2) if self.batches else 0.0,
+        }
+
+
+def _resolve(future, result, error):
+    # The caller may have been cancelled (client disconnected) in the meantime
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
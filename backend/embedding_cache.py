@@ -0,0 +1,150 @@
+# backend/embedding_cache.py
+
+import atexit
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# The LRU index is written to disk after this many new entries (and at exit)
+FLUSH_EVERY = 256
+KEY_BYTES = 32  # sha256 digest
+
+
+class EmbeddingCache:
+    """
+    Persistent embedding cache keyed by (model name, sha256 of the text).
+
+    Vectors live in a preallocated float32 memory-mapped file with one slot per
+    entry. A second memory-mapped file stores each slot's key digest, so a slot
+    is only trusted if its digest matches. The LRU order is kept in an
+    OrderedDict and persisted as JSON. When the cache is full, the least
+    recently used slot is reused.
+    """
+
+    def __init__(self, directory: str, model_name: str, dim: int, max_bytes: int):
+        self.dim = dim
+        self.capacity = max(1, max_bytes // (dim * 4 + KEY_BYTES))
+        self.directory = os.path.join(directory, model_name.replace("/", "__"))
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._vectors_path = os.path.join(self.directory, "vectors.f32")
+        self._keys_path = os.path.join(self.directory, "keys.bin")
+        self._index_path = os.path.join(self.directory, "index.json")
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # hex digest -> slot, least recently used first
+        self._next_slot = 0
+        self._dirty = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._open()
+        atexit.register(self.flush)
+
+    def _open(self):
+        index = None
+        if os.path.exists(self._index_path):
+            try:
+                with open(self._index_path) as f:
+                    index = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"[EMBED CACHE] Ignoring unreadable index: {e}")
+
+        # Reuse the existing files only if they were created with the same layout
+        reuse = (
+            index is not None
+            and index.get("dim") == self.dim
+            and index.get("capacity") == self.capacity
+            and os.path.exists(self._vectors_path)
+            and os.path.exists(self._keys_path)
+        )
+        mode = "r+" if reuse else "w+"
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode=mode, shape=(self.capacity, self.dim))
+        self._keys = np.memmap(self._keys_path, dtype=np.uint8, mode=mode, shape=(self.capacity, KEY_BYTES))
+
+        if reuse:
+            for key, slot in index["entries"]:
+                self._entries[key] = slot
+            self._next_slot = index["next_slot"]
+            print(f"[EMBED CACHE] Loaded {len(self._entries)} cached embeddings from {self.directory}")
+
+    @staticmethod
+    def _digest(text: str) -> bytes:
+        return hashlib.sha256(text.encode("utf-8")).digest()
+
+    def get_many(self, texts: list) -> list:
+        """Returns a list with a cached vector (copy) or None for each text."""
+        results = []
+        with self._lock:
+            for text in texts:
+                digest = self._digest(text)
+                key = digest.hex()
+                slot = self._entries.get(key)
+                if slot is not None and self._keys[slot].tobytes() == digest:
+                    self._entries.move_to_end(key)
+                    results.append(np.array(self._vectors[slot]))
+                    self.hits += 1
+                else:
+                    if slot is not None:
+                        # The slot was reused before the index was flushed
+                        del self._entries[key]
+                    results.append(None)
+                    self.misses += 1
+        return results
+
+    def put_many(self, texts: list, vectors):
+        """Stores vectors for the given texts, evicting least recently used entries."""
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                digest = self._digest(text)
+                key = digest.hex()
+                slot = self._entries.get(key)
+                if slot is None:
+                    if self._next_slot < self.capacity:
+                        slot = self._next_slot
+                        self._next_slot += 1
+                    else:
+                        _, slot = self._entries.popitem(last=False)
+                    self._entries[key] = slot
+                else:
+                    self._entries.move_to_end(key)
+                self._vectors[slot] = vector
+                self._keys[slot] = np.frombuffer(digest, dtype=np.uint8)
+                self._dirty += 1
+
+            if self._dirty >= FLUSH_EVERY:
+                self._flush_locked()
+
+    def flush(self):
+        """Writes pending vectors and the LRU index to disk."""
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._dirty:
+            return
+        self._vectors.flush()
+        self._keys.flush()
+        index = {
+            "dim": self.dim,
+            "capacity": self.capacity,
+            "next_slot": self._next_slot,
+            "entries": list(self._entries.items()),
+        }
+        tmp_path = self._index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self._index_path)
+        self._dirty = 0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,137 @@
+# backend/history_manager.py
+
+import os
+
+from dotenv import load_dotenv
+
+from llm_handler import SYSTEM_PROMPT, summarize_conversation
+
+load_dotenv()
+
+# Upper bound for everything sent to the LLM: system prompt, summary, history,
+# retrieved context and the question
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
+# Part of the budget the verbatim chat history may use; older turns are folded
+# into the rolling summary once it is exceeded
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1500"))
+# Most recent messages kept verbatim, however short they are
+HISTORY_RECENT_MESSAGES = int(os.getenv("HISTORY_RECENT_MESSAGES", "6"))
+
+# Share of the context budget each section is guaranteed, in priority order.
+# Whatever a section doesn't use goes to the next ones.
+CONTEXT_SHARES = (
+    ("Document Context", 0.5),
+    ("Visual Context", 0.25),
+    ("Web Search Results", 0.25),
+)
+
+# Rough English average for the Llama tokenizer; avoids loading a tokenizer
+CHARS_PER_TOKEN = 4
+# Per-message overhead of the chat template
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _message_tokens(messages: list) -> int:
+    return sum(estimate_tokens(msg["content"]) + MESSAGE_OVERHEAD_TOKENS for msg in messages)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cuts text down to roughly max_tokens, at a word boundary."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ""
+    cut = text[:max_tokens * CHARS_PER_TOKEN]
+    space = cut.rfind(" ")
+    if space > len(cut) // 2:
+        cut = cut[:space]
+    return cut.rstrip() + " …"
+
+
+def _recent_window(messages: list, budget: int, max_messages: int) -> int:
+    """Index from which the messages fit in budget and number at most max_messages."""
+    start = len(messages)
+    used = 0
+    while start > 0 and len(messages) - start < max_messages:
+        cost = _message_tokens(messages[start - 1:start])
+        if used + cost > budget:
+            break
+        used += cost
+        start -= 1
+    return start
+
+
+async def prepare_history(session: dict):
+    """
+    Returns (recent_history, summary) to send with the current question, which
+    is expected to be the last message of the session's chat history.
+
+    Recent turns are kept verbatim. When they outgrow HISTORY_TOKEN_BUDGET, the
+    older ones are folded into session["history_summary"] and removed from the
+    session, and the window shrinks to half the budget and half the message
+    count so the summary is only refreshed every few turns rather than on
+    every message. The caller saves the session.
+    """
+    history = session["chat_history"][:-1]
+    summary = session.get("history_summary")
+
+    if len(history) <= HISTORY_RECENT_MESSAGES and _message_tokens(history) <= HISTORY_TOKEN_BUDGET:
+        return history, summary
+
+    start = _recent_window(history, HISTORY_TOKEN_BUDGET // 2, max(1, HISTORY_RECENT_MESSAGES // 2))
+    if start > 0:
+        new_summary = await summarize_conversation(summary, history[:start])
+        if new_summary:
+            summary = new_summary
+            session["history_summary"] = new_summary
+            del session["chat_history"][:start]
+            print(f"[HISTORY] Folded {start} messages into the summary")
+        else:
+            # Keep the turns and retry next time; this prompt still stays within budget
+            print(f"[HISTORY] Summarization failed; leaving {start} old messages out of this prompt")
+
+    recent = history[start:]
+    if not recent and history:
+        # A single message larger than the window: keep a truncated copy of it
+        last = dict(history[-1])
+        last["content"] = truncate_to_tokens(last["content"], HISTORY_TOKEN_BUDGET // 2)
+        recent = [last]
+    return recent, summary
+
+
+def build_context(sections: dict, question: str, history: list, summary: str = None) -> str:
+    """
+    Joins the context sections ({"Document Context": text, ...}) into a single
+    string, truncating them so the whole prompt fits PROMPT_TOKEN_BUDGET.
+    """
+    fixed = (
+        estimate_tokens(SYSTEM_PROMPT) + estimate_tokens(summary) + estimate_tokens(question)
+        + _message_tokens(history) + 3 * MESSAGE_OVERHEAD_TOKENS
+    )
+    budget = max(0, PROMPT_TOKEN_BUDGET - fixed)
+
+    needs = {title: estimate_tokens(sections.get(title)) for title, _ in CONTEXT_SHARES}
+    allowed = {title: min(needs[title], int(budget * share)) for title, share in CONTEXT_SHARES}
+    leftover = budget - sum(allowed.values())
+    for title, _ in CONTEXT_SHARES:
+        extra = min(leftover, needs[title] - allowed[title])
+        allowed[title] += extra
+        leftover -= extra
+
+    parts = []
+    for title, _ in CONTEXT_SHARES:
+        text = sections.get(title)
+        if not text:
+            continue
+        if allowed[title] < needs[title]:
+            print(f"[HISTORY] Truncating {title} from ~{needs[title]} to ~{allowed[title]} tokens")
+        text = truncate_to_tokens(text, allowed[title])
+        if text:
+            parts.append(f"{title}:\n{text}")
+    return "\n\n".join(parts)
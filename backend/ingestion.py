@@ -0,0 +1,352 @@
+# backend/ingestion.py
+
+import asyncio
+import datetime
+import json
+import multiprocessing
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from document_processor import count_pages, extract_page_blocks, build_chunks, split_page_ranges
+from page_renderer import get_page_image
+import document_store
+import sparse_index
+import vector_manifest
+from vector_store import embed_chunks_and_upload_to_pinecone
+from vlm_handler import analyze_chart_comprehensively, is_usable_vlm_answer, CHART_ANALYSIS_PROMPT_VERSION
+import vlm_cache
+import database
+
+# Number of ingestion jobs processed concurrently by the async workers
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+# Number of processes used for CPU-bound work (PDF parsing and rendering)
+INGEST_PROCESS_WORKERS = int(os.getenv("INGEST_PROCESS_WORKERS", str(os.cpu_count() or 1)))
+# Finished jobs are kept this long so clients can still read their final status
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", "3600"))
+# "memory" keeps job progress in the process running the job; "sql" also writes it to
+# the ingestion_jobs table so every worker can report it (needed with several workers)
+JOB_STORE = os.getenv("JOB_STORE", "memory")
+# With the SQL store, progress is written at most this often; status changes always are
+JOB_PERSIST_INTERVAL = float(os.getenv("JOB_PERSIST_INTERVAL", "1.0"))
+# Optional stage: analyze every image page with the VLM once at ingestion time
+VLM_PRECOMPUTE = os.getenv("VLM_PRECOMPUTE", "0") == "1"
+VLM_PRECOMPUTE_CONCURRENCY = int(os.getenv("VLM_PRECOMPUTE_CONCURRENCY", "2"))
+
+TERMINAL_STATUSES = ("completed", "failed")
+
+jobs = {}
+_queue = None
+_worker_tasks = []
+_process_pool = None
+_persist_executor = None
+
+
+def get_process_pool():
+    """Returns the shared process pool, creating it on first use."""
+    global _process_pool
+    if _process_pool is None:
+        # "spawn" keeps the children free of the parent's model weights and threads
+        _process_pool = ProcessPoolExecutor(
+            max_workers=INGEST_PROCESS_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _process_pool
+
+
+def _get_persist_executor():
+    global _persist_executor
+    if _persist_executor is None:
+        # A single thread, so a job's snapshots reach the database in order
+        _persist_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-store")
+    return _persist_executor
+
+
+def _persist_job(state: dict):
+    db = database.SessionLocal()
+    try:
+        now = datetime.datetime.utcnow()
+        db.merge(database.IngestionJob(job_id=state["id"], state=json.dumps(state), updated_at=now))
+        if state["status"] == "queued":
+            db.query(database.IngestionJob).filter(
+                database.IngestionJob.updated_at < now - datetime.timedelta(seconds=JOB_TTL_SECONDS)
+            ).delete(synchronize_session=False)
+        db.commit()
+    except Exception as e:
+        # Progress reporting must not break the ingestion itself
+        print(f"[INGEST] Could not store the state of job {state['id']}: {e}")
+    finally:
+        db.close()
+
+
+def _load_persisted_job(job_id: str):
+    db = database.SessionLocal()
+    try:
+        row = db.get(database.IngestionJob, job_id)
+        return json.loads(row.state) if row is not None else None
+    finally:
+        db.close()
+
+
+def _public_fields(job: dict) -> dict:
+    return {key: value for key, value in job.items() if not key.startswith("_")}
+
+
+def _update_job(job: dict, **fields):
+    status_changed = fields.get("status", job["status"]) != job["status"]
+    job.update(fields)
+    job["updated_at"] = time.time()
+    if JOB_STORE == "sql" and (status_changed or job["updated_at"] - job["_persisted_at"] >= JOB_PERSIST_INTERVAL):
+        job["_persisted_at"] = job["updated_at"]
+        _get_persist_executor().submit(_persist_job, _public_fields(job))
+
+
+def _prune_finished_jobs():
+    now = time.time()
+    expired = [
+        job_id for job_id, job in jobs.items()
+        if job["status"] in TERMINAL_STATUSES and now - job["updated_at"] > JOB_TTL_SECONDS
+    ]
+    for job_id in expired:
+        del jobs[job_id]
+
+
+def get_job(job_id: str):
+    """
+    Returns a copy of the job's public fields, or None if it does not exist.
+    With the SQL job store, jobs run by other workers are read from the
+    database, so this may block; call it from a worker thread.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return _load_persisted_job(job_id) if JOB_STORE == "sql" else None
+    return _public_fields(job)
+
+
+async def submit_ingestion(file_path: str, filename: str, document_id: int = None, content_hash: str = None) -> dict:
+    """
+    Queues a document for background ingestion and returns the new job.
+    When document_id is given, the Document row is marked as ingested on success.
+    content_hash keys the precomputed VLM analyses of the document's pages.
+    """
+    _prune_finished_jobs()
+    now = time.time()
+    job = {
+        "id": uuid.uuid4().hex,
+        "filename": filename,
+        "status": "queued",
+        "message": "Waiting to be processed.",
+        "pages_total": None,
+        "pages_parsed": 0,
+        "chunks_total": 0,
+        "chunks_embedded": 0,
+        "vectors_upserted": 0,
+        "vectors_failed": 0,
+        "vectors_unchanged": 0,
+        "vectors_deleted": 0,
+        "pages_analyzed": 0,
+        "error": None,
+        "created_at": now,
+        "updated_at": now,
+        "_file_path": file_path,
+        "_document_id": document_id,
+        "_content_hash": content_hash,
+        "_persisted_at": now,
+    }
+    jobs[job["id"]] = job
+    if JOB_STORE == "sql":
+        # Stored before the client learns the job id, so any worker can answer for it
+        await asyncio.get_running_loop().run_in_executor(_get_persist_executor(), _persist_job, _public_fields(job))
+
+    start_workers()
+    await _queue.put(job["id"])
+    print(f"[INGEST] Queued job {job['id']} for '{filename}'")
+    return get_job(job["id"])
+
+
+def _mark_document_ingested(document_id: int, chunk_count: int):
+    db = database.SessionLocal()
+    try:
+        document = db.get(database.Document, document_id)
+        if document is not None:
+            document.chunk_count = chunk_count
+            db.commit()
+    finally:
+        db.close()
+
+
+async def _parse_shard(loop, file_path: str, start: int, end: int, image_dir: str):
+    pages = await loop.run_in_executor(
+        get_process_pool(), extract_page_blocks, file_path, start, end, image_dir
+    )
+    return start, end, pages
+
+
+async def _precompute_page_analyses(job: dict, image_pages: list) -> list:
+    """
+    Runs the comprehensive chart analysis once for every image page, stores it in
+    the VLM cache and returns it as extra chunks so it is retrievable as text.
+    """
+    doc_hash = job["_content_hash"]
+    if not image_pages:
+        return []
+    _update_job(job, status="analyzing", message=f"Analyzing {len(image_pages)} visual pages.")
+    semaphore = asyncio.Semaphore(VLM_PRECOMPUTE_CONCURRENCY)
+
+    async def analyze(page_number):
+        analysis = vlm_cache.get_page_analysis(doc_hash, page_number, CHART_ANALYSIS_PROMPT_VERSION)
+        if analysis is None:
+            async with semaphore:
+                image_path = await asyncio.to_thread(get_page_image, doc_hash, page_number)
+                if image_path:
+                    analysis = await asyncio.to_thread(analyze_chart_comprehensively, image_path)
+            if not is_usable_vlm_answer(analysis):
+                analysis = None
+            else:
+                vlm_cache.store_page_analysis(doc_hash, page_number, CHART_ANALYSIS_PROMPT_VERSION, analysis)
+        _update_job(job, pages_analyzed=job["pages_analyzed"] + 1)
+        return page_number, analysis
+
+    results = await asyncio.gather(*(analyze(page_number) for page_number in image_pages))
+    return [
+        {
+            'text': f"[Visual content analysis of page {page_number}]\n{analysis}",
+            'page_number': page_number,
+            'has_images': True,
+            'source': 'vlm',
+        }
+        for page_number, analysis in results
+        if analysis
+    ]
+
+
+async def _run_job(job: dict):
+    loop = asyncio.get_running_loop()
+    file_path = job["_file_path"]
+    filename = job["filename"]
+
+    pages_total = await loop.run_in_executor(get_process_pool(), count_pages, file_path)
+    _update_job(job, status="parsing", message="Parsing document.", pages_total=pages_total)
+
+    # Each shard opens its own copy of the PDF in a pool process
+    image_dir = document_store.image_dir(job["_content_hash"]) if job["_content_hash"] else None
+    shards = [
+        _parse_shard(loop, file_path, start, end, image_dir)
+        for start, end in split_page_ranges(pages_total, INGEST_PROCESS_WORKERS)
+    ]
+    shard_results = {}
+    for next_done in asyncio.as_completed(shards):
+        start, end, pages = await next_done
+        shard_results[start] = pages
+        _update_job(job, pages_parsed=job["pages_parsed"] + (end - start))
+
+    # Chunks may span shard boundaries, so they are built from all pages' blocks at once
+    pages = [page for start in sorted(shard_results) for page in shard_results[start]]
+    chunks_with_metadata = await asyncio.to_thread(build_chunks, pages)
+    print(f"[INGEST] Parsed {pages_total} pages of '{filename}' into {len(chunks_with_metadata)} chunks")
+    if not chunks_with_metadata:
+        _update_job(
+            job, status="failed",
+            message="Could not extract text from the document.",
+            error="no_text",
+        )
+        return
+
+    if VLM_PRECOMPUTE and job["_content_hash"]:
+        image_pages = [page['page_number'] for page in pages if page['has_images']]
+        chunks_with_metadata += await _precompute_page_analyses(job, image_pages)
+
+    if job["_content_hash"]:
+        # The BM25 side of hybrid retrieval; ids follow the same chunk order as the vectors
+        await asyncio.to_thread(sparse_index.build_and_save, job["_content_hash"], chunks_with_metadata, filename)
+
+    # Only chunks that are new or whose metadata changed since the last ingestion are re-embedded
+    plan = await asyncio.to_thread(vector_manifest.plan_sync, filename, chunks_with_metadata)
+    _update_job(
+        job, status="embedding",
+        message="Embedding and storing chunks.",
+        chunks_total=len(plan["upsert"]),
+        vectors_unchanged=plan["unchanged"],
+    )
+    def on_progress(stage, count):
+        # Called from the embedding thread; plain dict updates are safe under the GIL
+        if stage == "embedded":
+            _update_job(job, chunks_embedded=job["chunks_embedded"] + count)
+        else:
+            _update_job(job, vectors_upserted=job["vectors_upserted"] + count)
+
+    # Embedding is CPU heavy but the model lives in this process, so keep it off the event loop
+    summary = await asyncio.to_thread(
+        embed_chunks_and_upload_to_pinecone, plan["upsert"], filename,
+        progress_callback=on_progress,
+    )
+    _update_job(job, vectors_failed=summary["failed"])
+    failed_indexes = {i for start, end in summary["failed_batches"] for i in range(start, end)}
+    written = [chunk for i, chunk in enumerate(plan["upsert"]) if i not in failed_indexes]
+    await asyncio.to_thread(vector_manifest.record_vectors, filename, written)
+    if plan["upsert"] and not summary["written"]:
+        _update_job(
+            job, status="failed",
+            message="Failed to store the document's embeddings.",
+            error="upsert_failed",
+        )
+        return
+
+    # Stale vectors are only removed once the new ones are all stored, so a failed
+    # re-ingestion never leaves the document with fewer chunks than before
+    if not summary["failed"]:
+        await asyncio.to_thread(vector_manifest.delete_vectors, plan["stale"])
+        _update_job(job, vectors_deleted=len(plan["stale"]))
+
+    # Partially stored documents stay unmarked so that re-uploading them retries ingestion
+    if job["_document_id"] is not None and not summary["failed"]:
+        await asyncio.to_thread(_mark_document_ingested, job["_document_id"], len(chunks_with_metadata))
+
+    message = f"Successfully processed '{filename}'. Stored {summary['written']} chunks."
+    if plan["unchanged"]:
+        message += f" {plan['unchanged']} unchanged chunks were kept."
+    if job["vectors_deleted"]:
+        message += f" Removed {job['vectors_deleted']} stale chunks."
+    if summary["failed"]:
+        message += f" {summary['failed']} chunks could not be stored."
+    _update_job(job, status="completed", message=message)
+
+
+async def _worker():
+    while True:
+        job_id = await _queue.get()
+        job = jobs.get(job_id)
+        try:
+            if job is not None:
+                await _run_job(job)
+        except Exception as e:
+            print(f"[INGEST ERROR] Job {job_id} failed: {e}")
+            _update_job(job, status="failed", message="Ingestion failed.", error=str(e))
+        finally:
+            _queue.task_done()
+
+
+def start_workers():
+    """Starts the async ingestion workers on the running event loop (idempotent)."""
+    global _queue
+    if _queue is None:
+        _queue = asyncio.Queue()
+    if not _worker_tasks:
+        for _ in range(INGEST_WORKERS):
+            _worker_tasks.append(asyncio.create_task(_worker()))
+
+
+async def shutdown():
+    """Cancels the workers and shuts down the process pool."""
+    global _process_pool, _persist_executor
+    for task in _worker_tasks:
+        task.cancel()
+    await asyncio.gather(*_worker_tasks, return_exceptions=True)
+    _worker_tasks.clear()
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+    if _persist_executor is not None:
+        _persist_executor.shutdown(wait=True)
+        _persist_executor = None
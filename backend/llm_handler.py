@@ -1,14 +1,45 @@
 # backend/llm_handler.py
 import os
-from groq import Groq
+import asyncio
+import threading
+import time
 from dotenv import load_dotenv
 import re
 
 load_dotenv()
 
-client = Groq(
-    api_key=os.getenv("GROQ_API_KEY"),
-)
+# Async client so model streams never block the event loop. Created on first
+# use so importing this module needs neither the groq package nor the network.
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from groq import AsyncGroq
+
+                _client = AsyncGroq(
+                    api_key=os.getenv("GROQ_API_KEY"),
+                )
+    return _client
+
+
+# Streaming policy. Tokens are coalesced into one SSE frame until the frame
+# reaches STREAM_COALESCE_BYTES or STREAM_COALESCE_MS has passed since the last
+# frame (0/0 sends every token as its own frame). STREAM_PACING_MS adds an
+# artificial delay after each frame; it is off by default because the typing
+# effect is rendered by the frontend.
+STREAM_COALESCE_BYTES = int(os.getenv("STREAM_COALESCE_BYTES", "48"))
+STREAM_COALESCE_MS = float(os.getenv("STREAM_COALESCE_MS", "40"))
+STREAM_PACING_MS = float(os.getenv("STREAM_PACING_MS", "0"))
+
+LLM_ERROR_MESSAGE = "Sorry, I'm having trouble connecting to the language model. 😔 Please try again in a moment."
+
+# Small model used to fold old chat turns into a rolling summary
+SUMMARY_MODEL = os.getenv("HISTORY_SUMMARY_MODEL", "llama-3.1-8b-instant")
 
 def is_casual_conversation(query: str) -> tuple[bool, str]:
     """
@@ -59,42 +90,48 @@ def is_casual_conversation(query: str) -> tuple[bool, str]:
     return False, None
 
 
-def _build_messages(query: str, context: str, chat_history: list):
-    """Helper function to build the messages list"""
-    system_prompt = (
-        "You are Veritas, a friendly and intelligent document analysis assistant. "
-        "Your personality is helpful, clear, and conversational.\n\n"
-        
-        "The context may include:\n"
-        "1. 'Document Context': Text extracted directly from the document.\n"
-        "2. 'Visual Context': Information extracted from visual elements (charts, graphs, images).\n"
-        "3. 'Web Search Results': Snippets from a web search.\n\n"
-        
-        "Important instructions:\n"
-        "- Be conversational and friendly in your responses\n"
-        "- Synthesize information from all available contexts to provide a comprehensive answer\n"
-        "- If information from the document and web search results differ, prioritize the document's content but note the discrepancy\n"
-        "- Answer questions directly and concisely\n"
-        "- When information comes from visual content, mention that (e.g., 'According to the chart on page 3...')\n"
-        "- If the answer requires information from both text and visuals, synthesize them clearly\n"
-        "- If the context doesn't contain relevant information, politely say: "
-        "'I couldn't find that information in your document. Would you like me to search the web?' "
-        "or if web search is enabled: 'I couldn't find that in your document, but here's what I found online...'\n"
-        "- Be specific and cite page numbers when relevant\n"
-        "- If the user asks something very general (like 'tell me about this document'), provide a helpful summary\n"
-        "- Use emojis occasionally to be more engaging, but don't overdo it\n"
-    )
+SYSTEM_PROMPT = (
+    "You are Veritas, a friendly and intelligent document analysis assistant. "
+    "Your personality is helpful, clear, and conversational.\n\n"
+    
+    "The context may include:\n"
+    "1. 'Document Context': Text extracted directly from the document.\n"
+    "2. 'Visual Context': Information extracted from visual elements (charts, graphs, images).\n"
+    "3. 'Web Search Results': Snippets from a web search.\n\n"
     
+    "Important instructions:\n"
+    "- Be conversational and friendly in your responses\n"
+    "- Synthesize information from all available contexts to provide a comprehensive answer\n"
+    "- If information from the document and web search results differ, prioritize the document's content but note the discrepancy\n"
+    "- Answer questions directly and concisely\n"
+    "- When information comes from visual content, mention that (e.g., 'According to the chart on page 3...')\n"
+    "- If the answer requires information from both text and visuals, synthesize them clearly\n"
+    "- If the context doesn't contain relevant information, politely say: "
+    "'I couldn't find that information in your document. Would you like me to search the web?' "
+    "or if web search is enabled: 'I couldn't find that in your document, but here's what I found online...'\n"
+    "- Be specific and cite page numbers when relevant\n"
+    "- If the user asks something very general (like 'tell me about this document'), provide a helpful summary\n"
+    "- Use emojis occasionally to be more engaging, but don't overdo it\n"
+)
+
+
+def _build_messages(query: str, context: str, chat_history: list, summary: str = None):
+    """
+    Helper function to build the messages list.
+    chat_history is expected to be already windowed to the prompt budget (see
+    history_manager.py); summary covers the older turns folded out of it.
+    """
     user_prompt = f"Context:\n{context}\n\nQuestion:\n{query}"
 
     messages = [
-        {"role": "system", "content": system_prompt},
+        {"role": "system", "content": SYSTEM_PROMPT},
     ]
+    if summary:
+        messages.append({"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"})
     
-    # Include entire chat history (not just last 4 messages)
     # Clean up chat history - convert any "bot" roles to "assistant"
     cleaned_history = []
-    for msg in chat_history:  # Use all messages, not just [-4:]
+    for msg in chat_history:
         cleaned_msg = msg.copy()
         if cleaned_msg.get("role") == "bot":
             cleaned_msg["role"] = "assistant"
@@ -106,58 +143,67 @@ def _build_messages(query: str, context: str, chat_history: list):
     return messages
 
 
-async def get_chat_response_streaming(query: str, context: str, chat_history: list = []):
+async def get_chat_response_streaming(query: str, context: str, chat_history: list = [], summary: str = None):
     """
     Generates a STREAMING response from the LLM.
     This is an async generator that yields chunks of text.
+    If the consumer stops early (e.g. the SSE client disconnects and the task is
+    cancelled), the upstream Groq stream is closed instead of being drained.
     """
-    import asyncio
-    
-    messages = _build_messages(query, context, chat_history)
+    messages = _build_messages(query, context, chat_history, summary)
     
+    chat_completion = None
     try:
-        chat_completion = client.chat.completions.create(
+        chat_completion = await get_client().chat.completions.create(
             messages=messages,
             model="llama-3.3-70b-versatile",
             temperature=0.3,
             stream=True,
         )
         
-        # Stream content as it arrives with natural typing delay
+        # Stream content as it arrives, coalescing tokens into larger frames
         buffer = ""
-        for chunk in chat_completion:
+        last_flush = time.monotonic()
+        async for chunk in chat_completion:
             content = chunk.choices[0].delta.content or ""
-            if content:
-                buffer += content
-                
-                # Split buffer into words and yield them with delay
-                words = buffer.split(' ')
-                
-                # Keep the last incomplete word in buffer
-                if len(words) > 1:
-                    for word in words[:-1]:
-                        yield word + ' '
-                        await asyncio.sleep(0.03)  # 30ms delay per word for natural feel
-                    buffer = words[-1]
+            if not content:
+                continue
+            buffer += content
+
+            now = time.monotonic()
+            if (len(buffer.encode("utf-8")) >= STREAM_COALESCE_BYTES
+                    or (now - last_flush) * 1000 >= STREAM_COALESCE_MS):
+                yield buffer
+                buffer = ""
+                last_flush = now
+                if STREAM_PACING_MS:
+                    await asyncio.sleep(STREAM_PACING_MS / 1000)
         
         # Yield any remaining content in buffer
         if buffer:
             yield buffer
-                
+    
+    except asyncio.CancelledError:
+        print("[DEBUG] Client disconnected, aborting LLM stream.")
+        raise
     except Exception as e:
         print(f"Error getting streaming response from Groq: {e}")
-        yield "Sorry, I'm having trouble connecting to the language model. 😔 Please try again in a moment."
+        yield LLM_ERROR_MESSAGE
+    finally:
+        # Closing the response aborts the upstream HTTP stream
+        if chat_completion is not None:
+            await chat_completion.close()
 
 
-async def get_chat_response_non_streaming(query: str, context: str, chat_history: list = []):
+async def get_chat_response_non_streaming(query: str, context: str, chat_history: list = [], summary: str = None):
     """
     Generates a NON-STREAMING response from the LLM.
     Returns the complete response as a string.
     """
-    messages = _build_messages(query, context, chat_history)
+    messages = _build_messages(query, context, chat_history, summary)
     
     try:
-        chat_completion = client.chat.completions.create(
+        chat_completion = await get_client().chat.completions.create(
             messages=messages,
             model="llama-3.3-70b-versatile",
             temperature=0.3,
@@ -167,16 +213,45 @@ async def get_chat_response_non_streaming(query: str, context: str, chat_history
         
     except Exception as e:
         print(f"Error getting non-streaming response from Groq: {e}")
-        return "Sorry, I'm having trouble connecting to the language model. 😔 Please try again in a moment."
+        return LLM_ERROR_MESSAGE
+
+
+async def summarize_conversation(previous_summary: str, messages: list) -> str:
+    """
+    Folds older chat messages into a rolling summary using a small, fast model.
+    Returns None if the model call fails.
+    """
+    transcript = "\n".join(
+        f"{'Assistant' if msg['role'] in ('bot', 'assistant') else 'User'}: {msg['content']}"
+        for msg in messages
+    )
+    prompt = (
+        "Update the summary of a conversation between a user and Veritas, a document analysis assistant. "
+        "Keep the facts, numbers, page references and open questions the user cares about. "
+        "Reply with the updated summary only, in at most 200 words.\n\n"
+        f"Current summary:\n{previous_summary or '(none)'}\n\n"
+        f"New messages:\n{transcript}"
+    )
+    try:
+        chat_completion = await get_client().chat.completions.create(
+            messages=[{"role": "user", "content": prompt}],
+            model=SUMMARY_MODEL,
+            temperature=0.1,
+            max_tokens=400,
+        )
+        return chat_completion.choices[0].message.content.strip()
+    except Exception as e:
+        print(f"Error summarizing chat history with Groq: {e}")
+        return None
 
 
-def get_chat_response(query: str, context: str, chat_history: list = [], stream: bool = False):
+def get_chat_response(query: str, context: str, chat_history: list = [], stream: bool = False, summary: str = None):
     """
     Main function that returns the appropriate response handler based on the stream parameter.
     """
     if stream:
         # Return the streaming async generator
-        return get_chat_response_streaming(query, context, chat_history)
+        return get_chat_response_streaming(query, context, chat_history, summary)
     else:
         # Return the non-streaming coroutine
-        return get_chat_response_non_streaming(query, context, chat_history)
\ No newline at end of file
+        return get_chat_response_non_streaming(query, context, chat_history, summary)
\ No newline at end of file
@@ -1,25 +1,37 @@
 # backend/main.py
 
 import os
-import shutil
+import hashlib
 import json
-from fastapi import FastAPI, UploadFile, File, Depends
+import re
+import time
+import uuid
+from typing import Optional
+from fastapi import FastAPI, UploadFile, File, Depends, HTTPException, Header, Response
 from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from sqlalchemy import text
 from sqlalchemy.orm import Session
 import asyncio
 
-from document_processor import process_pdf
-from vector_store import embed_chunks_and_upload_to_pinecone, query_pinecone
-from llm_handler import get_chat_response, is_casual_conversation
-from vlm_handler import query_image_with_vlm, is_visual_query, analyze_chart_comprehensively
-from web_search import search_web
+from vector_store import query_embedder
+from retrieval import hybrid_search, server_timing_header
+from llm_handler import get_chat_response, is_casual_conversation, LLM_ERROR_MESSAGE
+from vlm_handler import (
+    query_image_with_vlm, is_visual_query, analyze_chart_comprehensively,
+    is_usable_vlm_answer, CHART_ANALYSIS_PROMPT_VERSION,
+)
+from web_search import search_web, format_web_results, close_client as close_web_search_client
 import database
-
-UPLOAD_DIRECTORY = "./uploads"
-if not os.path.exists(UPLOAD_DIRECTORY):
-    os.makedirs(UPLOAD_DIRECTORY)
+import ingestion
+import vlm_cache
+import page_renderer
+import document_store
+from session_store import create_session_store
+import warmup
+from history_manager import prepare_history, build_context
+from answer_cache import answer_cache, ANSWER_CACHE_ENABLED
 
 app = FastAPI()
 
@@ -27,68 +39,243 @@ origins = ["http://localhost:3000"]
 app.add_middleware(
     CORSMiddleware, allow_origins=origins, allow_credentials=True,
     allow_methods=["*"], allow_headers=["*"],
+    expose_headers=["X-Session-Id", "Server-Timing"],
 )
 
-app.state.current_doc_filename = None
-app.state.chat_history = []
+# Conversation state (chat history and active document) is scoped to a session.
+# Clients send their session id in the X-Session-Id header; requests without one
+# start a new session whose id is returned in the same header.
+session_store = create_session_store()
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+JOB_EVENTS_POLL_INTERVAL = float(os.getenv("JOB_EVENTS_POLL_INTERVAL", "0.5"))
+
+# Per-page VLM calls run concurrently, at most VLM_MAX_CONCURRENCY at a time
+VLM_MAX_CONCURRENCY = int(os.getenv("VLM_MAX_CONCURRENCY", "3"))
+VLM_TIMEOUT_SECONDS = float(os.getenv("VLM_TIMEOUT_SECONDS", "30"))
+vlm_semaphore = asyncio.Semaphore(VLM_MAX_CONCURRENCY)
+
+CHART_QUESTION_WORDS = ['chart', 'graph', 'value', 'rating', 'score', 'barrier', 'number', 'scale', 'issue']
+
+@app.on_event("startup")
+async def start_ingestion_workers():
+    ingestion.start_workers()
+
+@app.on_event("startup")
+async def start_warmup():
+    # In the background, so /health answers while models load
+    if warmup.WARMUP_ON_STARTUP:
+        asyncio.create_task(asyncio.to_thread(warmup.warm_up))
+
+@app.on_event("shutdown")
+async def stop_ingestion_workers():
+    await ingestion.shutdown()
+    await close_web_search_client()
+    query_embedder.shutdown()
 
 class ChatRequest(BaseModel):
     message: str
     search_web: bool = True
 
-@app.post("/api/upload")
-async def upload_file(file: UploadFile = File(...), db: Session = Depends(database.get_db)):
-    file_path = os.path.join(UPLOAD_DIRECTORY, file.filename)
+def get_session_id(x_session_id: Optional[str] = Header(default=None)) -> str:
+    if x_session_id is None:
+        return uuid.uuid4().hex
+    if not SESSION_ID_PATTERN.match(x_session_id):
+        raise HTTPException(status_code=400, detail="Invalid X-Session-Id header")
+    return x_session_id
+
+async def load_session(session_id: str) -> dict:
+    return await asyncio.to_thread(session_store.get, session_id)
+
+async def save_session(session_id: str, session: dict):
+    await asyncio.to_thread(session_store.save, session_id, session)
+
+UPLOAD_READ_CHUNK = 1024 * 1024
+
+def _save_upload(source, file_path: str) -> str:
+    """Streams the upload to disk and returns the sha256 of its content."""
+    digest = hashlib.sha256()
     with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+        while True:
+            chunk = source.read(UPLOAD_READ_CHUNK)
+            if not chunk:
+                break
+            digest.update(chunk)
+            buffer.write(chunk)
+    return digest.hexdigest()
+
+@app.post("/api/upload")
+async def upload_file(
+    response: Response,
+    file: UploadFile = File(...),
+    db: Session = Depends(database.get_db),
+    session_id: str = Depends(get_session_id),
+):
+    response.headers["X-Session-Id"] = session_id
+    # The document id is only known once the content is hashed, so stream to a temporary name first
+    partial_path = os.path.join(document_store.DOCUMENTS_DIRECTORY, f"{uuid.uuid4().hex}.part")
+    content_hash = await asyncio.to_thread(_save_upload, file.file, partial_path)
+
+    session = await load_session(session_id)
+    session["chat_history"] = []  # Reset chat history on new upload
+    session["history_summary"] = None
+
+    # Identical bytes were already ingested: switch to that document and skip processing
+    existing = (
+        db.query(database.Document)
+        .filter(database.Document.content_hash == content_hash, database.Document.chunk_count.isnot(None))
+        .order_by(database.Document.id.desc())
+        .first()
+    )
+    if existing:
+        os.remove(partial_path)
+        print(f"[DEBUG] Duplicate upload of '{existing.filename}' ({content_hash[:12]}), skipping ingestion")
+        session["current_doc_filename"] = existing.filename
+        session["current_doc_hash"] = content_hash
+        await save_session(session_id, session)
+        return {
+            "session_id": session_id,
+            "filename": existing.filename,
+            "job_id": None,
+            "status": "completed",
+            "duplicate": True,
+            "message": f"'{file.filename}' was already processed. Stored {existing.chunk_count} chunks."
+        }
+
+    file_path = document_store.document_path(content_hash)
+    os.replace(partial_path, file_path)
 
     # Add document to the database
-    db_document = database.Document(filename=file.filename)
+    db_document = database.Document(filename=file.filename, content_hash=content_hash)
     db.add(db_document)
+    # Vectors are stored per filename, so this upload replaces those of earlier versions;
+    # they must be ingested again rather than skipped as duplicates
+    db.query(database.Document).filter(
+        database.Document.filename == file.filename,
+        database.Document.content_hash != content_hash,
+    ).update({database.Document.chunk_count: None}, synchronize_session=False)
     db.commit()
     db.refresh(db_document)
 
-    app.state.current_doc_filename = file.filename
-    app.state.chat_history = []  # Reset chat history on new upload
-
-    chunks_with_metadata = process_pdf(file_path)
-    if not chunks_with_metadata:
-        return {"message": "Could not extract text from the document."}
+    session["current_doc_filename"] = file.filename
+    session["current_doc_hash"] = content_hash
+    await save_session(session_id, session)
 
-    embed_chunks_and_upload_to_pinecone(chunks_with_metadata, file_id=file.filename)
+    # Parsing and embedding run in the background; the client follows the job
+    job = await ingestion.submit_ingestion(
+        file_path, file.filename, document_id=db_document.id, content_hash=content_hash
+    )
 
     return {
+        "session_id": session_id,
         "filename": file.filename,
-        "message": f"Successfully processed '{file.filename}'. Stored {len(chunks_with_metadata)} chunks."
+        "job_id": job["id"],
+        "status": job["status"],
+        "duplicate": False,
+        "message": f"Received '{file.filename}'. Processing it in the background..."
     }
 
-def get_image_path_from_page(page_number):
-    """Constructs the path to the saved page image."""
-    page_num_int = int(page_number)
-
-    image_dir = os.path.join(UPLOAD_DIRECTORY, "images")
-    image_path = os.path.join(image_dir, f"page_{page_num_int}.png")
-
-    print(f"[DEBUG] Looking for image at: {image_path}")
-    print(f"[DEBUG] Image exists: {os.path.exists(image_path)}")
+@app.get("/api/cache/answers")
+def get_answer_cache_stats():
+    return answer_cache.stats()
+
+@app.get("/api/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    job = await asyncio.to_thread(ingestion.get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/api/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    if await asyncio.to_thread(ingestion.get_job, job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def job_event_stream():
+        last_sent = None
+        while True:
+            job = await asyncio.to_thread(ingestion.get_job, job_id)
+            if job is None:
+                break
+            if job != last_sent:
+                yield f"data: {json.dumps(job)}\n\n"
+                last_sent = job
+            if job["status"] in ingestion.TERMINAL_STATUSES:
+                break
+            await asyncio.sleep(JOB_EVENTS_POLL_INTERVAL)
+        yield "data: [DONE]\n\n"
 
-    if os.path.exists(image_path):
-        return image_path
-    return None
+    return StreamingResponse(job_event_stream(), media_type="text/event-stream")
+
+def get_image_path_from_page(page_number, doc_hash: str):
+    """
+    Returns the path to the page image of the given document, rendering the
+    page on first use. Blocking; call it from a worker thread.
+    """
+    image_path = page_renderer.get_page_image(doc_hash, page_number)
+
+    print(f"[DEBUG] Page {page_number} image: {image_path}")
+    return image_path
+
+def _release_vlm_slot(call):
+    vlm_semaphore.release()
+    # Nobody awaits a call that timed out; report its late failure here instead
+    if not call.cancelled() and call.exception() is not None:
+        print(f"[DEBUG] VLM call failed: {call.exception()}")
+
+async def analyze_page_with_vlm(page_num, score, question: str, doc_hash: str):
+    """
+    Runs the blocking VLM call for one page in a worker thread, bounded by the
+    shared semaphore and a per-call timeout. Chart questions are answered from
+    the analysis precomputed at ingestion time when it exists.
+    Returns (page_num, answer or None).
+    """
+    is_chart_question = any(word in question.lower() for word in CHART_QUESTION_WORDS)
+    if is_chart_question:
+        cached_analysis = vlm_cache.get_page_analysis(doc_hash, page_num, CHART_ANALYSIS_PROMPT_VERSION)
+        if cached_analysis:
+            print(f"[DEBUG] → Using precomputed chart analysis for page {page_num} (score: {score:.3f})")
+            return page_num, cached_analysis
+
+    image_path = await asyncio.to_thread(get_image_path_from_page, page_num, doc_hash)
+    if not image_path:
+        return page_num, None
+
+    if is_chart_question:
+        print(f"[DEBUG] → Using comprehensive chart analysis for page {page_num} (score: {score:.3f})")
+        vlm_function = analyze_chart_comprehensively
+    else:
+        print(f"[DEBUG] → Using standard VLM query for page {page_num} (score: {score:.3f})")
+        vlm_function = query_image_with_vlm
+
+    await vlm_semaphore.acquire()
+    call = asyncio.get_running_loop().run_in_executor(None, vlm_function, image_path, question)
+    # A timed out call keeps running in its thread, so its slot is only freed once it finishes
+    call.add_done_callback(_release_vlm_slot)
+    try:
+        answer = await asyncio.wait_for(asyncio.shield(call), timeout=VLM_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        print(f"[DEBUG] VLM call for page {page_num} timed out after {VLM_TIMEOUT_SECONDS}s")
+        return page_num, None
+    return page_num, answer
 
 @app.post("/api/chat")
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, session_id: str = Depends(get_session_id)):
     print(f"\n{'='*80}")
     print(f"[DEBUG] New Query: {request.message}")
     print(f"[DEBUG] Web Search Enabled: {request.search_web}")
     print(f"{'='*80}")
 
-    app.state.chat_history.append({"role": "user", "content": request.message})
+    session = await load_session(session_id)
+    chat_history = session["chat_history"]
+    chat_history.append({"role": "user", "content": request.message})
+    stream_headers = {"X-Session-Id": session_id}
 
     is_casual, casual_response = is_casual_conversation(request.message)
     if is_casual:
         print("[DEBUG] Casual conversation detected - responding directly")
-        app.state.chat_history.append({"role": "assistant", "content": casual_response})
+        chat_history.append({"role": "assistant", "content": casual_response})
+        await save_session(session_id, session)
         
         # Send metadata first, then stream the response
         async def casual_stream():
@@ -103,11 +290,12 @@ async def chat(request: ChatRequest):
             yield f"data: {json.dumps({'type': 'content', 'content': casual_response})}\n\n"
             yield "data: [DONE]\n\n"
         
-        return StreamingResponse(casual_stream(), media_type="text/event-stream")
+        return StreamingResponse(casual_stream(), media_type="text/event-stream", headers=stream_headers)
 
-    if not app.state.current_doc_filename:
+    if not session["current_doc_filename"]:
         no_doc_response = "Please upload a document first."
-        app.state.chat_history.append({"role": "bot", "content": no_doc_response})
+        chat_history.append({"role": "bot", "content": no_doc_response})
+        await save_session(session_id, session)
         
         async def no_doc_stream():
             metadata = {
@@ -121,13 +309,58 @@ async def chat(request: ChatRequest):
             yield f"data: {json.dumps({'type': 'content', 'content': no_doc_response})}\n\n"
             yield "data: [DONE]\n\n"
         
-        return StreamingResponse(no_doc_stream(), media_type="text/event-stream")
+        return StreamingResponse(no_doc_stream(), media_type="text/event-stream", headers=stream_headers)
+
+    # Start the web search right away so it overlaps with retrieval and the VLM calls
+    web_task = None
+    if request.search_web:
+        print("[DEBUG] Web search enabled. Performing web search...")
+        web_task = asyncio.create_task(search_web(request.message))
+    else:
+        print("[DEBUG] Web search disabled for this query.")
+
+    def cancel_web_search():
+        if web_task is not None and not web_task.done():
+            web_task.cancel()
+
+    doc_hash = session["current_doc_hash"]
+    embed_started = time.perf_counter()
+    query_embedding = await query_embedder.embed(request.message)
+    embed_ms = round((time.perf_counter() - embed_started) * 1000, 1)
+
+    # Answers to follow-up questions depend on the conversation, so only a session's
+    # opening question is looked up in and stored to the shared cache
+    use_answer_cache = (
+        ANSWER_CACHE_ENABLED and doc_hash
+        and len(chat_history) == 1 and not session["history_summary"]
+    )
+    cached = None
+    if use_answer_cache:
+        cached = answer_cache.lookup(doc_hash, request.search_web, query_embedding)
+    if cached:
+        cancel_web_search()
+        chat_history.append({"role": "bot", "content": cached["answer"]})
+        await save_session(session_id, session)
+
+        # Replay the stored answer the same way a fresh one is streamed
+        async def cached_stream():
+            yield f"data: {json.dumps({**cached['metadata'], 'cached': True})}\n\n"
+            yield f"data: {json.dumps({'type': 'content', 'content': cached['answer']})}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(cached_stream(), media_type="text/event-stream", headers=stream_headers)
 
-    print(f"[DEBUG] Querying Pinecone...")
-    text_context, matches, pages_with_images = query_pinecone(request.message)
+    print(f"[DEBUG] Querying vector store for '{session['current_doc_filename']}'...")
+    # Off the event loop, so the web search keeps making progress meanwhile
+    text_context, matches, pages_with_images, timings = await asyncio.to_thread(
+        hybrid_search, request.message, session["current_doc_filename"],
+        doc_id=doc_hash, query_embedding=query_embedding,
+    )
+    stream_headers["Server-Timing"] = server_timing_header({"embed": embed_ms, **timings})
 
-    if not matches or matches[0]['score'] < 0.2:
+    if not matches:
         print("[DEBUG] Low relevance to document. Using general LLM.")
+        cancel_web_search()
         
         async def general_stream():
             metadata = {
@@ -139,122 +372,135 @@ async def chat(request: ChatRequest):
             }
             yield f"data: {json.dumps(metadata)}\n\n"
             
+            recent_history, summary = await prepare_history(session)
             full_response = ""
-            async for chunk in get_chat_response(request.message, "No relevant document context found.", app.state.chat_history, stream=True):
+            async for chunk in get_chat_response(request.message, "No relevant document context found.", recent_history, stream=True, summary=summary):
                 full_response += chunk
                 yield f"data: {json.dumps({'type': 'content', 'content': chunk})}\n\n"
             
-            app.state.chat_history.append({"role": "bot", "content": full_response})
+            chat_history.append({"role": "bot", "content": full_response})
+            await save_session(session_id, session)
             yield "data: [DONE]\n\n"
         
-        return StreamingResponse(general_stream(), media_type="text/event-stream")
+        return StreamingResponse(general_stream(), media_type="text/event-stream", headers=stream_headers)
 
     # Extract citation pages from matches
     citation_pages = []
     for match in matches:
-        page_num = match['metadata'].get('page_number')
-        if page_num and page_num not in citation_pages:
-            citation_pages.append(page_num)
+        first_page = match['metadata'].get('page_number')
+        if not first_page:
+            continue
+        # Chunks can run over onto the following pages
+        for page_num in range(int(first_page), int(match['metadata'].get('page_end', first_page)) + 1):
+            if page_num not in citation_pages:
+                citation_pages.append(page_num)
     
     citation_pages = sorted(citation_pages)[:5]  # Top 5 pages
     print(f"[DEBUG] Citation pages: {citation_pages}")
 
     async def response_generator():
-        vlm_context = ""
-        vlm_pages_used = []
         query_is_visual = is_visual_query(request.message)
         print(f"[DEBUG] Is visual query: {query_is_visual}")
 
+        # Start the VLM calls right away so they overlap with each other,
+        # the web search and the metadata frame
+        vlm_tasks = []
         if query_is_visual and pages_with_images:
             print(f"[DEBUG] ✓ Visual query detected with image pages!")
             print(f"[DEBUG] Pages with images in results: {list(pages_with_images.keys())}")
 
             sorted_pages = sorted(pages_with_images.items(), key=lambda x: x[1], reverse=True)[:3]
             print(f"[DEBUG] Processing top pages: {[p[0] for p in sorted_pages]}")
+            vlm_tasks = [
+                asyncio.create_task(analyze_page_with_vlm(page_num, score, request.message, doc_hash))
+                for page_num, score in sorted_pages
+            ]
 
-            for page_num, score in sorted_pages:
-                image_path = get_image_path_from_page(page_num)
-                if image_path:
-                    print(f"[DEBUG] → Querying VLM for page {page_num} (score: {score:.3f})")
-
-                    if any(word in request.message.lower() for word in ['chart', 'graph', 'value', 'rating', 'score', 'barrier', 'number', 'scale', 'issue']):
-                        print(f"[DEBUG] → Using comprehensive chart analysis")
-                        vlm_answer = analyze_chart_comprehensively(image_path, request.message)
-                    else:
-                        print(f"[DEBUG] → Using standard VLM query")
-                        vlm_answer = query_image_with_vlm(image_path, request.message)
-
-                    if vlm_answer and len(vlm_answer) > 10 and "Could not extract" not in vlm_answer and "Error" not in vlm_answer:
-                        vlm_context += f"\n\n[Visual content from page {page_num}]: {vlm_answer}"
-                        vlm_pages_used.append(page_num)
-
-        rag_context = f"Document Context:\n{text_context}"
-        if vlm_context:
-            rag_context += f"\n\nVisual Context:\n{vlm_context}"
-
-        print(f"[DEBUG] RAG context length: {len(rag_context)}")
-
-        # Send metadata first
-        metadata = {
-            "type": "metadata",
-            "citations": citation_pages,
-            "used_vlm": bool(vlm_pages_used),
-            "vlm_pages": vlm_pages_used,
-            "response_type": "document_query"
-        }
-        yield f"data: {json.dumps(metadata)}\n\n"
-
-        full_response = ""
-        if request.search_web:
-            print("[DEBUG] Web search enabled. Performing web search...")
-            web_search_results = search_web(request.message)
-
-            if web_search_results:
-                combined_context = rag_context + f"\n\nWeb Search Results:\n{web_search_results}"
-                print(f"[DEBUG] Combined context length: {len(combined_context)}")
-                print(f"[DEBUG] Generating web-enhanced response...")
-                async for chunk in get_chat_response(request.message, combined_context, app.state.chat_history, stream=True):
-                    full_response += chunk
-                    yield f"data: {json.dumps({'type': 'content', 'content': chunk})}\n\n"
-            else:
-                print("[DEBUG] No web search results found")
-                async for chunk in get_chat_response(request.message, rag_context, app.state.chat_history, stream=True):
-                    full_response += chunk
-                    yield f"data: {json.dumps({'type': 'content', 'content': chunk})}\n\n"
-        else:
-            print("[DEBUG] Web search disabled for this query.")
-            async for chunk in get_chat_response(request.message, rag_context, app.state.chat_history, stream=True):
-                full_response += chunk
-                yield f"data: {json.dumps({'type': 'content', 'content': chunk})}\n\n"
-        
-        app.state.chat_history.append({"role": "bot", "content": full_response})
-        yield "data: [DONE]\n\n"
-
-    return StreamingResponse(response_generator(), media_type="text/event-stream")
-
-def extract_web_sources(web_results: str) -> list:
-    """Extract source titles and links from web search results."""
-    sources = []
-    if not web_results:
-        return sources
-
-    results = web_results.split("\n\n---\n\n")
-
-    for result in results:
-        lines = result.strip().split("\n")
-        title = None
-        link = None
-
-        for line in lines:
-            if line.startswith("Title: "):
-                title = line.replace("Title: ", "").strip()
-            elif line.startswith("Link: "):
-                link = line.replace("Link: ", "").strip()
+        try:
+            # Send metadata first; citations are already known
+            metadata = {
+                "type": "metadata",
+                "citations": citation_pages,
+                "used_vlm": False,
+                "vlm_pages": [],
+                "web_sources": [],
+                "response_type": "document_query"
+            }
+            yield f"data: {json.dumps(metadata)}\n\n"
 
-        if title and link and link != "N/A":
-            sources.append({"title": title, "link": link})
+            vlm_context = ""
+            vlm_pages_used = []
+            # gather() keeps the relevance order of the pages
+            for page_num, vlm_answer in await asyncio.gather(*vlm_tasks):
+                if is_usable_vlm_answer(vlm_answer):
+                    vlm_context += f"\n\n[Visual content from page {page_num}]: {vlm_answer}"
+                    vlm_pages_used.append(page_num)
+
+            if vlm_pages_used:
+                metadata.update({"used_vlm": True, "vlm_pages": vlm_pages_used})
+                yield f"data: {json.dumps(metadata)}\n\n"
+
+            sections = {"Document Context": text_context, "Visual Context": vlm_context.strip()}
+            if web_task is not None:
+                web_results = await web_task
+                if web_results:
+                    sections["Web Search Results"] = format_web_results(web_results)
+                    metadata["web_sources"] = [result.source() for result in web_results]
+                    yield f"data: {json.dumps(metadata)}\n\n"
+                    print(f"[DEBUG] Generating web-enhanced response from {len(web_results)} sources...")
+                else:
+                    print("[DEBUG] No web search results found")
+
+            recent_history, summary = await prepare_history(session)
+            context = build_context(sections, request.message, recent_history, summary)
+            print(f"[DEBUG] Context length: {len(context)}")
 
-    return sources[:5]
+            full_response = ""
+            async for chunk in get_chat_response(request.message, context, recent_history, stream=True, summary=summary):
+                full_response += chunk
+                yield f"data: {json.dumps({'type': 'content', 'content': chunk})}\n\n"
+            
+            chat_history.append({"role": "bot", "content": full_response})
+            await save_session(session_id, session)
+            if use_answer_cache and full_response and LLM_ERROR_MESSAGE not in full_response:
+                answer_cache.store(doc_hash, request.search_web, query_embedding, request.message, full_response, metadata)
+            yield "data: [DONE]\n\n"
+        finally:
+            # Don't leave background work running if the client went away
+            for task in vlm_tasks + [web_task]:
+                if task is not None and not task.done():
+                    task.cancel()
+
+    return StreamingResponse(response_generator(), media_type="text/event-stream", headers=stream_headers)
+
+@app.get("/health")
+def health():
+    """Liveness: the process is up and serving requests."""
+    return {"status": "ok"}
+
+def _database_reachable() -> bool:
+    db = database.SessionLocal()
+    try:
+        db.execute(text("SELECT 1"))
+        return True
+    except Exception as e:
+        print(f"[READY] Database unreachable: {e}")
+        return False
+    finally:
+        db.close()
+
+@app.get("/ready")
+async def ready(response: Response):
+    """Readiness: warm-up finished and the database answers."""
+    database_ok = await asyncio.to_thread(_database_reachable)
+    is_ready = warmup.state["status"] == "ready" and database_ok
+    if not is_ready:
+        response.status_code = 503
+    return {
+        "status": "ready" if is_ready else "not_ready",
+        "warmup": warmup.state,
+        "database": database_ok,
+    }
 
 @app.get("/")
 def read_root():
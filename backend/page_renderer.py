@@ -0,0 +1,150 @@
+# backend/page_renderer.py
+
+import argparse
+import os
+import re
+import shutil
+import threading
+import time
+
+from dotenv import load_dotenv
+
+from document_processor import render_page, page_image_path
+import document_store
+
+load_dotenv()
+
+# Upper bound for page renders and the images prepared from them for the VLM,
+# across all documents
+RENDER_CACHE_MAX_MB = int(os.getenv("RENDER_CACHE_MAX_MB", "512"))
+
+# page_12.png, page_12.json, page_12.vlm-1600-q85-crop.webp, page_12.last-used, ... all belong to page 12
+_PAGE_FILE_PATTERN = re.compile(r"^(page_\d+)\.")
+
+_locks_guard = threading.Lock()
+_render_locks = {}
+# PyMuPDF does not support use from several threads at once, so renders in this
+# process (chat VLM calls and ingestion precompute) run one at a time
+_pymupdf_lock = threading.Lock()
+
+
+def _render_lock(image_path: str) -> threading.Lock:
+    with _locks_guard:
+        return _render_locks.setdefault(image_path, threading.Lock())
+
+
+def _mark_used(image_path: str):
+    """
+    Records a use of the page for eviction in a sidecar file. The render itself
+    keeps its mtime, which the prepared VLM images are checked against.
+    """
+    marker = os.path.splitext(image_path)[0] + ".last-used"
+    with open(marker, "a"):
+        pass
+    os.utime(marker)
+
+
+def get_page_image(doc_id: str, page_number: int):
+    """
+    Returns the path of the rendered image of a page of a document, rendering
+    it on first use. Returns None if neither the render nor the document's PDF
+    is available. Blocking; call it from a worker thread.
+    """
+    if not doc_id:
+        return None
+    image_dir = document_store.image_dir(doc_id)
+    image_path = page_image_path(image_dir, page_number)
+    with _render_lock(image_path):
+        if os.path.exists(image_path):
+            _mark_used(image_path)
+            return image_path
+
+        file_path = document_store.document_path(doc_id)
+        if not os.path.exists(file_path):
+            print(f"[RENDER] Source PDF not found at: {file_path}")
+            return None
+
+        with _pymupdf_lock:
+            started = time.perf_counter()
+            render_page(file_path, page_number, image_dir)
+        print(f"[RENDER] Rendered page {page_number} of {doc_id[:12]} "
+              f"in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    evict_renders(keep=image_path)
+    return image_path
+
+
+def evict_renders(keep: str = None):
+    """
+    Deletes the least recently used page renders (and their derived files)
+    until all documents' renders fit within RENDER_CACHE_MAX_MB.
+    """
+    pages = {}  # (doc_id, page key) -> [total bytes, last used, paths]
+    for doc_id in document_store.list_image_namespaces():
+        for entry in os.scandir(document_store.image_dir(doc_id)):
+            match = _PAGE_FILE_PATTERN.match(entry.name)
+            if not match or not entry.is_file():
+                continue
+            stat = entry.stat()
+            page = pages.setdefault((doc_id, match.group(1)), [0, 0.0, []])
+            page[0] += stat.st_size
+            page[1] = max(page[1], stat.st_mtime)
+            page[2].append(entry.path)
+
+    total = sum(page[0] for page in pages.values())
+    limit = RENDER_CACHE_MAX_MB * 1024 * 1024
+    if total <= limit:
+        return
+
+    for key, (size, _, paths) in sorted(pages.items(), key=lambda item: item[1][1]):
+        if total <= limit:
+            break
+        if keep in paths:
+            continue
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        total -= size
+        print(f"[RENDER] Evicted {key[1]} of {key[0][:12]}")
+
+
+def collect_orphaned_renders(dry_run: bool = False) -> list:
+    """
+    Removes render directories of documents that are no longer known: their
+    id is not a content hash in the documents table, or their PDF is gone.
+    Returns the removed document ids.
+    """
+    import database
+
+    db = database.SessionLocal()
+    try:
+        known = {
+            content_hash for (content_hash,) in
+            db.query(database.Document.content_hash).filter(database.Document.content_hash.isnot(None))
+        }
+    finally:
+        db.close()
+
+    orphaned = [
+        doc_id for doc_id in document_store.list_image_namespaces()
+        if doc_id not in known or not os.path.exists(document_store.document_path(doc_id))
+    ]
+    for doc_id in orphaned:
+        print(f"{'Would remove' if dry_run else 'Removing'} renders of {doc_id}")
+        if not dry_run:
+            shutil.rmtree(document_store.image_dir(doc_id), ignore_errors=True)
+    return orphaned
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the page render cache.")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    gc_parser = subcommands.add_parser("gc", help="Remove renders of documents that no longer exist.")
+    gc_parser.add_argument("--dry-run", action="store_true", help="Only list what would be removed.")
+    args = parser.parse_args()
+
+    if args.command == "gc":
+        removed = collect_orphaned_renders(dry_run=args.dry_run)
+        print(f"{len(removed)} orphaned render directories {'found' if args.dry_run else 'removed'}.")
@@ -0,0 +1,174 @@
+# backend/retrieval.py
+
+import math
+import os
+import re
+import threading
+import time
+
+from dotenv import load_dotenv
+
+from vector_store import encode_texts, dense_search
+import sparse_index
+import database
+
+load_dotenv()
+
+# "hybrid" fuses dense and BM25 results; "dense" only queries the vector store
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+# Candidates taken from each ranking before fusion
+RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", "20"))
+# BM25 candidates must contain at least this share of the query's distinct terms
+BM25_MIN_TERM_COVERAGE = float(os.getenv("BM25_MIN_TERM_COVERAGE", "0.5"))
+RRF_K = 60
+# Optional CPU cross-encoder, e.g. "cross-encoder/ms-marco-MiniLM-L-6-v2"; empty disables reranking
+RERANK_MODEL = os.getenv("RERANK_MODEL", "")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "10"))
+
+_PAGE_REFERENCE_PATTERN = re.compile(r"\bpage\s+(\d+)\b", re.IGNORECASE)
+
+_reranker = None
+_reranker_lock = threading.Lock()
+
+
+def _get_reranker():
+    global _reranker
+    with _reranker_lock:
+        if _reranker is None:
+            from sentence_transformers import CrossEncoder
+
+            print(f"Loading rerank model {RERANK_MODEL}...")
+            _reranker = CrossEncoder(RERANK_MODEL, device="cpu")
+            print("Rerank model loaded.")
+        return _reranker
+
+
+def _page_references(query: str, bm25) -> list:
+    """Chunks of the pages the query names explicitly ("what does page 4 say")."""
+    pages = {int(page) for page in _PAGE_REFERENCE_PATTERN.findall(query)}
+    if not pages or bm25 is None:
+        return []
+    return [
+        {"id": chunk_id, "score": 0.0, "metadata": metadata}
+        for chunk_id, metadata in zip(bm25.ids, bm25.metadata)
+        if any(metadata["page_number"] <= page <= metadata.get("page_end", metadata["page_number"]) for page in pages)
+    ][:RETRIEVAL_CANDIDATES]
+
+
+def _is_current_version(file_id: str, doc_id: str) -> bool:
+    """
+    Whether doc_id is the latest upload stored under file_id. Vectors are kept
+    per file_id, so once a different file is uploaded under the same name the
+    dense side searches that file while an older BM25 index still has the
+    previous version's chunks.
+    """
+    db = database.SessionLocal()
+    try:
+        latest = (
+            db.query(database.Document.content_hash)
+            .filter(database.Document.filename == file_id)
+            .order_by(database.Document.id.desc())
+            .first()
+        )
+    finally:
+        db.close()
+    return latest is not None and latest[0] == doc_id
+
+
+def reciprocal_rank_fusion(rankings: list) -> list:
+    """
+    Fuses ranked match lists into one, scoring each chunk by the sum of
+    1 / (RRF_K + rank) over the lists it appears in. Scores are scaled to
+    [0, 1], where 1 means first in every list.
+    """
+    rankings = [(name, ranking) for name, ranking in rankings if ranking]
+    if not rankings:
+        return []
+    fused = {}
+    for name, ranking in rankings:
+        for rank, match in enumerate(ranking, start=1):
+            entry = fused.setdefault(match["id"], {"id": match["id"], "score": 0.0, "metadata": match["metadata"]})
+            entry["score"] += 1.0 / (RRF_K + rank)
+            entry[f"{name}_score"] = match["score"]
+    best_possible = len(rankings) / (RRF_K + 1)
+    for entry in fused.values():
+        entry["score"] /= best_possible
+    return sorted(fused.values(), key=lambda entry: entry["score"], reverse=True)
+
+
+def _rerank(query: str, matches: list) -> list:
+    scores = _get_reranker().predict([(query, match["metadata"]["text"]) for match in matches])
+    for match, score in zip(matches, scores):
+        match["rerank_score"] = 1.0 / (1.0 + math.exp(-float(score)))
+        match["score"] = match["rerank_score"]
+    return sorted(matches, key=lambda match: match["score"], reverse=True)
+
+
+def hybrid_search(query: str, file_id: str, doc_id: str = None, top_k: int = 3,
+                  score_threshold: float = 0.55, query_embedding=None):
+    """
+    Retrieves the top_k chunks of a document by fusing dense matches (at least
+    score_threshold similar) with BM25 matches and chunks of explicitly named
+    pages, optionally reranked by a cross-encoder.
+    Returns context, matches, pages with images and per-stage timings in ms.
+    Blocking; call it from a worker thread.
+    """
+    timings = {}
+    started = time.perf_counter()
+
+    def lap(stage, since):
+        now = time.perf_counter()
+        timings[stage] = round((now - since) * 1000, 1)
+        return now
+
+    stage_start = started
+    if query_embedding is None:
+        query_embedding = encode_texts([query])[0]
+        stage_start = lap("embed", stage_start)
+
+    dense = [
+        match for match in dense_search(query_embedding, RETRIEVAL_CANDIDATES, file_ids=[file_id])
+        if match["score"] >= score_threshold
+    ]
+    stage_start = lap("dense", stage_start)
+
+    sparse, pages = [], []
+    bm25 = None
+    if RETRIEVAL_MODE == "hybrid" and doc_id:
+        if _is_current_version(file_id, doc_id):
+            bm25 = sparse_index.get_index(doc_id)
+        else:
+            print(f"[RETRIEVAL] '{file_id}' now holds a newer upload; skipping the sparse index of {doc_id[:12]}")
+    if bm25 is not None:
+        sparse = bm25.search(query, RETRIEVAL_CANDIDATES, min_term_coverage=BM25_MIN_TERM_COVERAGE)
+        pages = _page_references(query, bm25)
+        stage_start = lap("sparse", stage_start)
+
+    matches = reciprocal_rank_fusion([("dense", dense), ("bm25", sparse), ("page", pages)])
+    stage_start = lap("fusion", stage_start)
+
+    if RERANK_MODEL and len(matches) > 1:
+        matches = _rerank(query, matches[:RERANK_CANDIDATES])
+        stage_start = lap("rerank", stage_start)
+    matches = matches[:top_k]
+    timings["total"] = round((time.perf_counter() - started) * 1000, 1)
+    print(f"[RETRIEVAL] {len(dense)} dense + {len(sparse)} bm25 + {len(pages)} page candidates "
+          f"-> {len(matches)} matches; timings (ms): {timings}")
+
+    context = " ".join(match['metadata']['text'] for match in matches)
+
+    # Identify pages with images from the retrieved chunks
+    pages_with_images = {}
+    for match in matches:
+        if match['metadata'].get('has_images', False):
+            page_num = match['metadata'].get('image_page', match['metadata']['page_number'])
+            score = match['score']
+            if page_num not in pages_with_images or score > pages_with_images[page_num]:
+                pages_with_images[page_num] = score
+
+    return context, matches, pages_with_images, timings
+
+
+def server_timing_header(timings: dict) -> str:
+    """Formats stage timings as a Server-Timing header value."""
+    return ", ".join(f"{stage};dur={duration}" for stage, duration in timings.items())
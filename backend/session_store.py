@@ -0,0 +1,105 @@
+# backend/session_store.py
+
+import copy
+import datetime
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# "memory" (per-process LRU) or "sql" (shared through DATABASE_URL, works across workers and nodes)
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", "86400"))
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", "10000"))
+# The SQL backend deletes expired sessions once every this many saves
+SQL_CLEANUP_EVERY = 500
+
+
+def new_session_state() -> dict:
+    return {
+        "chat_history": [],
+        "history_summary": None,
+        "current_doc_filename": None,
+        "current_doc_hash": None,
+    }
+
+
+class InMemorySessionStore:
+    """Sessions kept in this process, evicted by TTL and least recent use."""
+
+    def __init__(self, ttl_seconds: int, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()  # session id -> (last used, state)
+
+    def get(self, session_id: str) -> dict:
+        """Returns a copy of the session's state, or a fresh state if it is unknown or expired."""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or time.time() - entry[0] > self.ttl_seconds:
+                self._sessions.pop(session_id, None)
+                return new_session_state()
+            self._sessions.move_to_end(session_id)
+            return copy.deepcopy(entry[1])
+
+    def save(self, session_id: str, state: dict):
+        with self._lock:
+            self._sessions[session_id] = (time.time(), copy.deepcopy(state))
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_entries:
+                self._sessions.popitem(last=False)
+
+
+class SQLSessionStore:
+    """Sessions stored in the chat_sessions table, shared by every worker."""
+
+    def __init__(self, ttl_seconds: int):
+        import database
+
+        self.database = database
+        self.ttl_seconds = ttl_seconds
+        self._saves = 0
+
+    def _expiry_cutoff(self):
+        return datetime.datetime.utcnow() - datetime.timedelta(seconds=self.ttl_seconds)
+
+    def get(self, session_id: str) -> dict:
+        db = self.database.SessionLocal()
+        try:
+            row = db.get(self.database.ChatSession, session_id)
+            if row is None or row.updated_at < self._expiry_cutoff():
+                return new_session_state()
+            return json.loads(row.state)
+        finally:
+            db.close()
+
+    def save(self, session_id: str, state: dict):
+        db = self.database.SessionLocal()
+        try:
+            db.merge(self.database.ChatSession(
+                session_id=session_id,
+                state=json.dumps(state),
+                updated_at=datetime.datetime.utcnow(),
+            ))
+            self._saves += 1
+            if self._saves % SQL_CLEANUP_EVERY == 0:
+                db.query(self.database.ChatSession).filter(
+                    self.database.ChatSession.updated_at < self._expiry_cutoff()
+                ).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+
+def create_session_store(name: str = SESSION_BACKEND):
+    if name == "memory":
+        return InMemorySessionStore(SESSION_TTL_SECONDS, SESSION_MAX_ENTRIES)
+    if name == "sql":
+        return SQLSessionStore(SESSION_TTL_SECONDS)
+    raise ValueError(f"Unknown SESSION_BACKEND '{name}'. Use 'memory' or 'sql'.")
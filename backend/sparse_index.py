@@ -0,0 +1,151 @@
+# backend/sparse_index.py
+
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+
+from dotenv import load_dotenv
+
+import document_store
+from document_processor import chunk_vector_id
+from vector_store import chunk_metadata
+
+load_dotenv()
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Loaded indexes kept in memory, least recently used evicted first
+SPARSE_INDEX_CACHE_SIZE = int(os.getenv("SPARSE_INDEX_CACHE_SIZE", "16"))
+
+# Words, and numbers with their decimal/thousands separators ("3.5", "1,200", "2023")
+_TOKEN_PATTERN = re.compile(r"[a-z]+|\d+(?:[.,]\d+)*")
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from has have how i in is it its "
+    "me my of on or tell that the their this to was were what when where which "
+    "who why will with you your about document page".split()
+)
+
+
+def tokenize(text: str) -> list:
+    return [token for token in _TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """Okapi BM25 over the chunks of a single document."""
+
+    def __init__(self, file_id: str, ids: list, metadata: list, term_freqs: list):
+        self.file_id = file_id
+        self.ids = ids
+        self.metadata = metadata
+        self.doc_lengths = [sum(tf.values()) for tf in term_freqs]
+        self.avg_length = (sum(self.doc_lengths) / len(self.doc_lengths)) if self.doc_lengths else 0.0
+
+        self.postings = {}  # term -> [(chunk index, term frequency)]
+        for i, tf in enumerate(term_freqs):
+            for term, count in tf.items():
+                self.postings.setdefault(term, []).append((i, count))
+        n = len(ids)
+        self.idf = {
+            term: math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+        self._term_freqs = term_freqs
+
+    @classmethod
+    def build(cls, chunks: list, file_id: str):
+        """Indexes chunks under the same ids and metadata as their vectors."""
+        ids = [chunk_vector_id(file_id, chunk) for chunk in chunks]
+        metadata = [chunk_metadata(chunk, file_id) for chunk in chunks]
+        term_freqs = [dict(Counter(tokenize(chunk['text']))) for chunk in chunks]
+        return cls(file_id, ids, metadata, term_freqs)
+
+    def save(self, path: str):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "file_id": self.file_id,
+                "ids": self.ids,
+                "metadata": self.metadata,
+                "term_freqs": self._term_freqs,
+            }, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data["file_id"], data["ids"], data["metadata"], data["term_freqs"])
+
+    def search(self, query: str, top_k: int, min_term_coverage: float = 0.0) -> list:
+        """
+        Returns up to top_k matches ({'id', 'score', 'metadata', 'term_coverage'})
+        sorted by BM25 score. Chunks containing less than min_term_coverage of the
+        query's distinct terms are skipped.
+        """
+        terms = set(tokenize(query))
+        if not terms or not self.ids:
+            return []
+        scores = {}
+        matched_terms = Counter()
+        for term in terms:
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for i, tf in self.postings[term]:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[i] / self.avg_length)
+                scores[i] = scores.get(i, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+                matched_terms[i] += 1
+
+        ranked = sorted(
+            (i for i in scores if matched_terms[i] / len(terms) >= min_term_coverage),
+            key=lambda i: scores[i], reverse=True,
+        )[:top_k]
+        return [
+            {
+                "id": self.ids[i],
+                "score": scores[i],
+                "metadata": self.metadata[i],
+                "term_coverage": matched_terms[i] / len(terms),
+            }
+            for i in ranked
+        ]
+
+
+_cache_lock = threading.Lock()
+_loaded = OrderedDict()  # doc id -> BM25Index
+
+
+def build_and_save(doc_id: str, chunks: list, file_id: str) -> BM25Index:
+    """Builds the sparse index of a document at ingestion and persists it."""
+    bm25 = BM25Index.build(chunks, file_id)
+    bm25.save(document_store.sparse_index_path(doc_id))
+    with _cache_lock:
+        _loaded[doc_id] = bm25
+        _loaded.move_to_end(doc_id)
+        while len(_loaded) > SPARSE_INDEX_CACHE_SIZE:
+            _loaded.popitem(last=False)
+    return bm25
+
+
+def get_index(doc_id: str):
+    """Returns the sparse index of a document, or None if it was never built."""
+    if not doc_id:
+        return None
+    with _cache_lock:
+        bm25 = _loaded.get(doc_id)
+        if bm25 is not None:
+            _loaded.move_to_end(doc_id)
+            return bm25
+
+    path = document_store.sparse_index_path(doc_id)
+    if not os.path.exists(path):
+        return None
+    bm25 = BM25Index.load(path)
+    with _cache_lock:
+        _loaded[doc_id] = bm25
+        while len(_loaded) > SPARSE_INDEX_CACHE_SIZE:
+            _loaded.popitem(last=False)
+    return bm25
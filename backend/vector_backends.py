@@ -0,0 +1,352 @@
+# backend/vector_backends.py
+
+import atexit
+import json
+import os
+import threading
+
+import numpy as np
+
+# Indexes smaller than this, and filters matching fewer vectors, are always searched exhaustively
+IVF_MIN_VECTORS = int(os.getenv("LOCAL_IVF_MIN_VECTORS", "10000"))
+IVF_NPROBE = int(os.getenv("LOCAL_IVF_NPROBE", "8"))
+IVF_TRAIN_ITERATIONS = 10
+# Pending local upserts are written to disk after this many vectors (and at exit)
+LOCAL_PERSIST_EVERY = int(os.getenv("LOCAL_PERSIST_EVERY", "1024"))
+# Pinecone accepts at most 1000 ids per delete request
+PINECONE_DELETE_BATCH = 1000
+
+
+class PineconeBackend:
+    """Vector store backed by a hosted Pinecone index."""
+
+    def __init__(self, index_name: str, api_key: str):
+        from pinecone import Pinecone
+
+        self.index_name = index_name
+        self.index = Pinecone(api_key=api_key).Index(index_name)
+
+    def upsert(self, vectors: list):
+        self.index.upsert(vectors=vectors)
+
+    def query(self, vector: list, top_k: int, filter: dict = None) -> dict:
+        results = self.index.query(
+            vector=vector,
+            top_k=top_k,
+            filter=filter,
+            include_metadata=True
+        )
+        return {
+            "matches": [
+                {"id": match["id"], "score": match["score"], "metadata": match["metadata"]}
+                for match in results["matches"]
+            ]
+        }
+
+    def delete(self, ids: list):
+        for start in range(0, len(ids), PINECONE_DELETE_BATCH):
+            self.index.delete(ids=ids[start:start + PINECONE_DELETE_BATCH])
+
+    def list_ids(self, prefix: str = ""):
+        """Yields the ids of the stored vectors, optionally only those starting with prefix."""
+        for page in self.index.list(prefix=prefix or None):
+            yield from page
+
+    def flush(self):
+        pass
+
+    def count(self) -> int:
+        return self.index.describe_index_stats()["total_vector_count"]
+
+
+class LocalVectorBackend:
+    """
+    In-process vector store for single-node deployments and offline runs.
+
+    Vectors are L2-normalised float32 rows in a memory-mapped file, so cosine
+    similarity is a single matrix-vector product. Ids and metadata are kept in a
+    JSON sidecar. file_id and page_number are mirrored into NumPy columns so that
+    the usual metadata filters are vectorised. Large indexes can use an IVF
+    coarse quantizer (k-means centroids) to search only the nearest lists.
+    """
+
+    def __init__(self, directory: str, dim: int, index_type: str = "flat"):
+        self.dim = dim
+        self.index_type = index_type
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._vectors_path = os.path.join(directory, "vectors.f32")
+        self._meta_path = os.path.join(directory, "meta.json")
+
+        self._lock = threading.RLock()
+        self._ids = []
+        self._metadata = []
+        self._rows = {}  # vector id -> row
+        self._file_codes = {}  # file_id -> small int used in the _file column
+        self._dirty = 0
+        self._centroids = None
+        self._assignments = None
+        self._trained_count = 0
+
+        self._load()
+        atexit.register(self.flush)
+
+    # ---- storage -------------------------------------------------------
+
+    def _load(self):
+        capacity = 1024
+        meta = None
+        if os.path.exists(self._meta_path) and os.path.exists(self._vectors_path):
+            with open(self._meta_path) as f:
+                meta = json.load(f)
+            if meta["dim"] != self.dim:
+                raise ValueError(
+                    f"Local vector index at {self.directory} has dim {meta['dim']}, expected {self.dim}"
+                )
+            capacity = meta["capacity"]
+
+        mode = "r+" if meta else "w+"
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode=mode, shape=(capacity, self.dim))
+        self._file = np.full(capacity, -1, dtype=np.int32)
+        self._page = np.zeros(capacity, dtype=np.int32)
+
+        if meta:
+            self._ids = meta["ids"]
+            self._metadata = meta["metadata"]
+            for row, (vector_id, metadata) in enumerate(zip(self._ids, self._metadata)):
+                self._rows[vector_id] = row
+                self._set_columns(row, metadata)
+            print(f"[LOCAL VECTORS] Loaded {len(self._ids)} vectors from {self.directory}")
+
+    def _grow(self, needed: int):
+        capacity = self._vectors.shape[0]
+        if needed <= capacity:
+            return
+        new_capacity = max(needed, capacity * 2)
+        tmp_path = self._vectors_path + ".tmp"
+        grown = np.memmap(tmp_path, dtype=np.float32, mode="w+", shape=(new_capacity, self.dim))
+        grown[:len(self._ids)] = self._vectors[:len(self._ids)]
+        grown.flush()
+        del grown
+        self._vectors.flush()
+        os.replace(tmp_path, self._vectors_path)
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r+", shape=(new_capacity, self.dim))
+        self._file = np.concatenate([self._file, np.full(new_capacity - capacity, -1, dtype=np.int32)])
+        self._page = np.concatenate([self._page, np.zeros(new_capacity - capacity, dtype=np.int32)])
+        self._dirty += 1
+
+    def _set_columns(self, row: int, metadata: dict):
+        file_id = metadata.get("file_id")
+        code = self._file_codes.setdefault(file_id, len(self._file_codes))
+        self._file[row] = code
+        self._page[row] = int(metadata.get("page_number") or 0)
+
+    def flush(self):
+        """Writes vectors and the metadata sidecar to disk if anything changed."""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._vectors.flush()
+            meta = {
+                "dim": self.dim,
+                "capacity": self._vectors.shape[0],
+                "ids": self._ids,
+                "metadata": self._metadata,
+            }
+            tmp_path = self._meta_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(meta, f)
+            os.replace(tmp_path, self._meta_path)
+            self._dirty = 0
+
+    # ---- writes --------------------------------------------------------
+
+    def upsert(self, vectors: list):
+        with self._lock:
+            new_count = sum(1 for v in vectors if v["id"] not in self._rows)
+            self._grow(len(self._ids) + new_count)
+            for vector in vectors:
+                values = np.asarray(vector["values"], dtype=np.float32)
+                norm = np.linalg.norm(values)
+                if norm > 0:
+                    values = values / norm
+                metadata = vector.get("metadata") or {}
+
+                row = self._rows.get(vector["id"])
+                if row is None:
+                    row = len(self._ids)
+                    self._rows[vector["id"]] = row
+                    self._ids.append(vector["id"])
+                    self._metadata.append(metadata)
+                    if self._assignments is not None:
+                        self._assignments = np.append(self._assignments, self._nearest_centroid(values))
+                else:
+                    self._metadata[row] = metadata
+                    if self._assignments is not None:
+                        self._assignments[row] = self._nearest_centroid(values)
+                self._vectors[row] = values
+                self._set_columns(row, metadata)
+            self._dirty += len(vectors)
+            if self._dirty >= LOCAL_PERSIST_EVERY:
+                self.flush()
+
+    def delete(self, ids: list):
+        with self._lock:
+            for vector_id in ids:
+                row = self._rows.pop(vector_id, None)
+                if row is None:
+                    continue
+                # Keep rows dense by moving the last row into the freed slot
+                last = len(self._ids) - 1
+                if row != last:
+                    moved_id = self._ids[last]
+                    self._vectors[row] = self._vectors[last]
+                    self._ids[row] = moved_id
+                    self._metadata[row] = self._metadata[last]
+                    self._file[row] = self._file[last]
+                    self._page[row] = self._page[last]
+                    if self._assignments is not None:
+                        self._assignments[row] = self._assignments[last]
+                    self._rows[moved_id] = row
+                self._ids.pop()
+                self._metadata.pop()
+                self._file[last] = -1
+                if self._assignments is not None:
+                    self._assignments = self._assignments[:last]
+                self._dirty += 1
+            self.flush()
+
+    # ---- search --------------------------------------------------------
+
+    def _field_mask(self, field: str, condition, count: int) -> np.ndarray:
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+
+        if field == "file_id":
+            column = self._file[:count]
+            convert = lambda value: self._file_codes.get(value, -2)
+        elif field == "page_number":
+            column = self._page[:count]
+            convert = int
+        else:
+            column = np.array([m.get(field) for m in self._metadata[:count]], dtype=object)
+            convert = lambda value: value
+
+        mask = np.ones(count, dtype=bool)
+        for op, value in condition.items():
+            if op == "$eq":
+                mask &= column == convert(value)
+            elif op == "$ne":
+                mask &= column != convert(value)
+            elif op == "$in":
+                mask &= np.isin(column, [convert(v) for v in value])
+            elif op == "$nin":
+                mask &= ~np.isin(column, [convert(v) for v in value])
+            elif op == "$gt":
+                mask &= column > convert(value)
+            elif op == "$gte":
+                mask &= column >= convert(value)
+            elif op == "$lt":
+                mask &= column < convert(value)
+            elif op == "$lte":
+                mask &= column <= convert(value)
+            else:
+                raise ValueError(f"Unsupported filter operator: {op}")
+        return mask
+
+    def _filter_mask(self, filter: dict, count: int) -> np.ndarray:
+        mask = np.ones(count, dtype=bool)
+        for key, condition in (filter or {}).items():
+            if key == "$and":
+                for sub_filter in condition:
+                    mask &= self._filter_mask(sub_filter, count)
+            elif key == "$or":
+                any_mask = np.zeros(count, dtype=bool)
+                for sub_filter in condition:
+                    any_mask |= self._filter_mask(sub_filter, count)
+                mask &= any_mask
+            else:
+                mask &= self._field_mask(key, condition, count)
+        return mask
+
+    def _nearest_centroid(self, values: np.ndarray) -> int:
+        return int(np.argmax(self._centroids @ values))
+
+    def _train_ivf(self, count: int):
+        """Clusters the stored vectors with spherical k-means to build the IVF lists."""
+        nlist = max(1, int(np.sqrt(count)))
+        rng = np.random.default_rng(0)
+        data = np.asarray(self._vectors[:count])
+        sample = data[rng.choice(count, size=min(count, nlist * 64), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)]
+        for _ in range(IVF_TRAIN_ITERATIONS):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            for i in range(nlist):
+                members = sample[labels == i]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    centroids[i] = centroid / (np.linalg.norm(centroid) or 1.0)
+        self._centroids = centroids
+        self._assignments = np.argmax(data @ centroids.T, axis=1)
+        self._trained_count = count
+        print(f"[LOCAL VECTORS] Trained IVF index with {nlist} lists over {count} vectors")
+
+    def query(self, vector: list, top_k: int, filter: dict = None) -> dict:
+        with self._lock:
+            count = len(self._ids)
+            if count == 0:
+                return {"matches": []}
+
+            query_vector = np.asarray(vector, dtype=np.float32)
+            query_vector = query_vector / (np.linalg.norm(query_vector) or 1.0)
+            mask = self._filter_mask(filter, count)
+
+            # A filter that already leaves few candidates (one document's chunks) is searched
+            # exactly; probing would keep only the part of them that falls in the probed lists
+            if self.index_type == "ivf" and count >= IVF_MIN_VECTORS and mask.sum() >= IVF_MIN_VECTORS:
+                # Retrain once the index has doubled since the last training run
+                if self._centroids is None or count > 2 * self._trained_count:
+                    self._train_ivf(count)
+                probes = np.argsort(self._centroids @ query_vector)[-IVF_NPROBE:]
+                mask &= np.isin(self._assignments[:count], probes)
+
+            rows = np.flatnonzero(mask)
+            if len(rows) == 0:
+                return {"matches": []}
+
+            scores = self._vectors[rows] @ query_vector
+            k = min(top_k, len(rows))
+            best = np.argpartition(-scores, k - 1)[:k]
+            best = best[np.argsort(-scores[best])]
+            return {
+                "matches": [
+                    {
+                        "id": self._ids[rows[i]],
+                        "score": float(scores[i]),
+                        "metadata": self._metadata[rows[i]],
+                    }
+                    for i in best
+                ]
+            }
+
+    def list_ids(self, prefix: str = ""):
+        """Yields the ids of the stored vectors, optionally only those starting with prefix."""
+        with self._lock:
+            ids = [vector_id for vector_id in self._ids if vector_id.startswith(prefix)]
+        yield from ids
+
+    def count(self) -> int:
+        return len(self._ids)
+
+
+def create_vector_backend(name: str, dim: int, index_name: str):
+    """Creates the vector store backend selected by name ("pinecone" or "local")."""
+    if name == "pinecone":
+        return PineconeBackend(index_name=index_name, api_key=os.getenv("PINECONE_API_KEY"))
+    if name == "local":
+        return LocalVectorBackend(
+            directory=os.getenv("LOCAL_VECTOR_DIR", "./cache/vectors"),
+            dim=dim,
+            index_type=os.getenv("LOCAL_VECTOR_INDEX", "flat"),
+        )
+    raise ValueError(f"Unknown VECTOR_BACKEND '{name}'. Use 'pinecone' or 'local'.")
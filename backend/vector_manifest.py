@@ -0,0 +1,189 @@
+# backend/vector_manifest.py
+
+import argparse
+import datetime
+import hashlib
+import json
+import re
+
+from dotenv import load_dotenv
+
+import database
+from document_processor import chunk_vector_id
+from vector_store import chunk_metadata, get_index
+
+load_dotenv()
+
+# Manifest rows are written and deleted in batches of this many
+MANIFEST_BATCH_SIZE = 500
+
+# Vector ids are "<file_id>-<content hash>"; "<file_id>-chunk-<n>" is the older positional form
+_VECTOR_ID_PATTERN = re.compile(r"^(?P<file_id>.+)-(?:[0-9a-f]{32}|chunk-\d+)$")
+
+
+def metadata_hash(metadata: dict) -> str:
+    """
+    Fingerprint of a vector's metadata. The text is left out because it is
+    already part of the vector id; a change in anything else (page numbers,
+    image flags) means the stored vector has to be re-upserted.
+    """
+    fields = {key: value for key, value in metadata.items() if key != "text"}
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def file_id_of(vector_id: str):
+    """The file_id a vector id belongs to, or None if the id has an unknown format."""
+    match = _VECTOR_ID_PATTERN.match(vector_id)
+    return match.group("file_id") if match else None
+
+
+def load_manifest(file_id: str) -> dict:
+    """Returns {vector_id: metadata_hash} for the vectors recorded for file_id."""
+    db = database.SessionLocal()
+    try:
+        rows = db.query(database.DocumentVector.vector_id, database.DocumentVector.metadata_hash).filter(
+            database.DocumentVector.file_id == file_id
+        )
+        return {vector_id: digest for vector_id, digest in rows}
+    finally:
+        db.close()
+
+
+def plan_sync(file_id: str, chunks: list) -> dict:
+    """
+    Compares a document's new chunks with its manifest. Returns the chunks to
+    upsert (new ids or changed metadata), the number of unchanged vectors and
+    the ids of stored vectors the document no longer has.
+    """
+    manifest = load_manifest(file_id)
+    # Chunks with identical text share an id; the last one wins, as it would on upsert
+    by_id = {chunk_vector_id(file_id, chunk): chunk for chunk in chunks}
+    upsert = [
+        chunk for vector_id, chunk in by_id.items()
+        if manifest.get(vector_id) != metadata_hash(chunk_metadata(chunk, file_id))
+    ]
+    stale = [vector_id for vector_id in manifest if vector_id not in by_id]
+    if not manifest:
+        # First ingestion under the manifest: vectors stored before it existed
+        # (including positional "-chunk-<n>" ids) are found in the index itself
+        try:
+            stale = [
+                vector_id for vector_id in get_index().list_ids(f"{file_id}-")
+                if file_id_of(vector_id) == file_id and vector_id not in by_id
+            ]
+        except Exception as e:
+            # Listing is not available on every index (Pinecone pod indexes) and
+            # must not fail the ingestion; vacuum can remove leftovers later
+            print(f"[MANIFEST] Could not list the stored vectors of '{file_id}': {e}")
+    return {
+        "upsert": upsert,
+        "unchanged": len(by_id) - len(upsert),
+        "stale": stale,
+    }
+
+
+def record_vectors(file_id: str, chunks: list):
+    """Adds or updates the manifest rows of chunks that were stored in the vector index."""
+    now = datetime.datetime.utcnow()
+    db = database.SessionLocal()
+    try:
+        for start in range(0, len(chunks), MANIFEST_BATCH_SIZE):
+            for chunk in chunks[start:start + MANIFEST_BATCH_SIZE]:
+                db.merge(database.DocumentVector(
+                    vector_id=chunk_vector_id(file_id, chunk),
+                    file_id=file_id,
+                    metadata_hash=metadata_hash(chunk_metadata(chunk, file_id)),
+                    updated_at=now,
+                ))
+            db.commit()
+    finally:
+        db.close()
+
+
+def _forget_vectors(vector_ids: list):
+    db = database.SessionLocal()
+    try:
+        for start in range(0, len(vector_ids), MANIFEST_BATCH_SIZE):
+            db.query(database.DocumentVector).filter(
+                database.DocumentVector.vector_id.in_(vector_ids[start:start + MANIFEST_BATCH_SIZE])
+            ).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def delete_vectors(vector_ids: list):
+    """Deletes vectors from the index in batches, then drops their manifest rows."""
+    if not vector_ids:
+        return
+    index = get_index()
+    index.delete(vector_ids)
+    index.flush()
+    _forget_vectors(vector_ids)
+
+
+def vacuum(file_id: str = None, dry_run: bool = False) -> dict:
+    """
+    Deletes orphaned vectors, for one file_id or across the whole index:
+    vectors of file_ids that no longer have a Document row, and vectors of
+    managed file_ids (ones with a manifest) that are missing from it, such as
+    positional "-chunk-<n>" leftovers. Vectors of documents ingested before
+    the manifest existed are only reported; re-uploading them brings them
+    under the manifest.
+    """
+    db = database.SessionLocal()
+    try:
+        documents = {filename for (filename,) in db.query(database.Document.filename).distinct()}
+        manifest_query = db.query(database.DocumentVector.vector_id, database.DocumentVector.file_id)
+        if file_id is not None:
+            manifest_query = manifest_query.filter(database.DocumentVector.file_id == file_id)
+        manifest = dict(manifest_query)
+    finally:
+        db.close()
+    managed = set(manifest.values())
+
+    orphaned = []
+    unmanaged = {}
+    prefix = f"{file_id}-" if file_id is not None else ""
+    for vector_id in get_index().list_ids(prefix):
+        owner = file_id_of(vector_id)
+        if owner is None or (file_id is not None and owner != file_id):
+            continue
+        if owner not in documents:
+            orphaned.append(vector_id)
+        elif vector_id not in manifest:
+            if owner in managed:
+                orphaned.append(vector_id)
+            else:
+                unmanaged[owner] = unmanaged.get(owner, 0) + 1
+    # Manifest rows of deleted documents whose vectors are already gone from the index
+    listed = set(orphaned)
+    forgotten = [vector_id for vector_id, owner in manifest.items() if owner not in documents and vector_id not in listed]
+
+    summary = {
+        "file_id": file_id,
+        "orphaned_vectors": len(orphaned),
+        "forgotten_rows": len(forgotten),
+        "unmanaged": unmanaged,
+        "dry_run": dry_run,
+    }
+    if not dry_run:
+        delete_vectors(orphaned)
+        _forget_vectors(forgotten)
+    print(f"[VACUUM] {'Would delete' if dry_run else 'Deleted'} {len(orphaned)} orphaned vectors "
+          f"and {len(forgotten)} manifest rows" + (f" of '{file_id}'" if file_id is not None else ""))
+    for owner, count in sorted(unmanaged.items()):
+        print(f"[VACUUM] '{owner}' has {count} vectors without a manifest; they are kept until it is re-ingested")
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-document vector manifest maintenance.")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    vacuum_parser = subcommands.add_parser("vacuum", help="Delete orphaned vectors from the index.")
+    vacuum_parser.add_argument("--file-id", help="Only vacuum this document's vectors (default: the whole index).")
+    vacuum_parser.add_argument("--dry-run", action="store_true", help="Report what would be deleted.")
+    args = parser.parse_args()
+
+    if args.command == "vacuum":
+        vacuum(args.file_id, args.dry_run)
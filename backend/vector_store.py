@@ -1,72 +1,247 @@
 import os
-from pinecone import Pinecone
-from sentence_transformers import SentenceTransformer
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from dotenv import load_dotenv
+from embedding_cache import EmbeddingCache
+from embedding_backends import create_embedding_backend
+from embedding_batcher import QueryEmbeddingBatcher, QUERY_EMBED_MAX_BATCH, QUERY_EMBED_WINDOW_MS
+from vector_backends import create_vector_backend
+from document_processor import chunk_vector_id
 
 load_dotenv()
-print("Loading embedding model...")
-model = SentenceTransformer('sentence-transformers/paraphrase-MiniLM-L3-v2')
-print("Embedding model loaded.")
+MODEL_NAME = 'sentence-transformers/paraphrase-MiniLM-L3-v2'
+# "torch" (SentenceTransformer), "onnx" or "onnx-int8" (ONNX Runtime, see embedding_backends.py)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
 
-pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+# On-disk cache of embeddings so re-uploads and repeated questions skip the model
+EMBED_CACHE_DIR = os.getenv("EMBED_CACHE_DIR", "./cache/embeddings")
+EMBED_CACHE_MAX_MB = int(os.getenv("EMBED_CACHE_MAX_MB", "256"))  # 0 disables the cache
+
+# "pinecone" (hosted) or "local" (in-process NumPy index persisted under LOCAL_VECTOR_DIR)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "pinecone")
 INDEX_NAME = "veritas-hf"
-index = pc.Index(INDEX_NAME)
 
-def embed_chunks_and_upload_to_pinecone(chunks_with_metadata: list, file_id: str):
+# The model, the embedding cache and the vector index are created on first use
+# (or by warm_up), so importing this module stays fast and needs no network
+_init_lock = threading.RLock()
+_model = None
+_embedding_cache = None
+_index = None
+
+
+def get_model():
+    """Returns the embedding backend, which has encode(texts) and dim."""
+    global _model
+    if _model is None:
+        with _init_lock:
+            if _model is None:
+                print(f"Loading embedding model ({EMBEDDING_BACKEND})...")
+                _model = create_embedding_backend(EMBEDDING_BACKEND, MODEL_NAME)
+                print("Embedding model loaded.")
+    return _model
+
+
+def get_embedding_cache():
+    """Returns the embedding cache, or None if it is disabled."""
+    global _embedding_cache
+    if _embedding_cache is None and EMBED_CACHE_MAX_MB > 0:
+        with _init_lock:
+            if _embedding_cache is None:
+                # Backends produce slightly different vectors, so the ONNX ones get their own cache
+                cache_name = MODEL_NAME if EMBEDDING_BACKEND == "torch" else f"{MODEL_NAME}@{EMBEDDING_BACKEND}"
+                _embedding_cache = EmbeddingCache(
+                    EMBED_CACHE_DIR, cache_name,
+                    dim=get_model().dim,
+                    max_bytes=EMBED_CACHE_MAX_MB * 1024 * 1024,
+                )
+    return _embedding_cache
+
+
+def get_index():
+    global _index
+    if _index is None:
+        with _init_lock:
+            if _index is None:
+                _index = create_vector_backend(VECTOR_BACKEND, get_model().dim, INDEX_NAME)
+    return _index
+
+
+def is_initialized() -> dict:
+    return {"embedding_model": _model is not None, "vector_index": _index is not None}
+
+
+# Chunks encoded per forward pass and sent per upsert request
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+UPSERT_MAX_RETRIES = int(os.getenv("UPSERT_MAX_RETRIES", "3"))
+UPSERT_RETRY_BACKOFF = float(os.getenv("UPSERT_RETRY_BACKOFF", "1.0"))
+
+def encode_texts(texts: list) -> np.ndarray:
     """
-    Embeds chunks and uploads them to Pinecone with metadata.
+    Returns float32 embeddings for texts, encoding only the ones missing from
+    the embedding cache.
     """
-    print(f"Embedding {len(chunks_with_metadata)} chunks for file_id: {file_id}")
-    try:
-        # Separate the chunks from the metadata
-        chunks = [item['text'] for item in chunks_with_metadata]
-        
-        embeddings = model.encode(chunks).tolist()
-        
-        vectors_to_upsert = [
-            {
-                "id": f"{file_id}-chunk-{i}",
-                "values": emb,
-                "metadata": {
-                    "text": chunk,
-                    "page_number": chunks_with_metadata[i]['page_number'],
-                    "has_images": chunks_with_metadata[i].get('has_images', False),  # Store image flag
-                    "file_id": file_id
+    model = get_model()
+    embedding_cache = get_embedding_cache()
+    if embedding_cache is None:
+        return model.encode(texts)
+
+    cached = embedding_cache.get_many(texts)
+    missing = [i for i, vector in enumerate(cached) if vector is None]
+    if missing:
+        encoded = model.encode([texts[i] for i in missing])
+        embedding_cache.put_many([texts[i] for i in missing], encoded)
+        for i, vector in zip(missing, encoded):
+            cached[i] = vector
+    return np.vstack(cached).astype(np.float32, copy=False)
+
+
+# Query embeddings of concurrent chat requests are encoded together on one thread
+query_embedder = QueryEmbeddingBatcher(encode_texts, QUERY_EMBED_MAX_BATCH, QUERY_EMBED_WINDOW_MS)
+
+
+def _batched(items, batch_size: int):
+    """Yields lists of up to batch_size items from any iterable, including generators."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _upsert_with_retry(vectors: list) -> bool:
+    """Upserts one batch, retrying with exponential backoff. Returns True on success."""
+    for attempt in range(1, UPSERT_MAX_RETRIES + 1):
+        try:
+            get_index().upsert(vectors=vectors)
+            return True
+        except Exception as e:
+            print(f"Upsert of {len(vectors)} vectors failed (attempt {attempt}/{UPSERT_MAX_RETRIES}): {e}")
+            if attempt < UPSERT_MAX_RETRIES:
+                time.sleep(UPSERT_RETRY_BACKOFF * 2 ** (attempt - 1))
+    return False
+
+
+def chunk_metadata(chunk: dict, file_id: str) -> dict:
+    """Metadata stored with a chunk's vector (and in its BM25 index entry)."""
+    metadata = {
+        "text": chunk['text'],
+        "page_number": chunk['page_number'],
+        "page_end": chunk.get('page_end', chunk['page_number']),
+        "has_images": chunk.get('has_images', False),  # Store image flag
+        "source": chunk.get('source', 'text'),  # "text" or "vlm" (precomputed page analysis)
+        "file_id": file_id
+    }
+    if 'image_page' in chunk:
+        metadata["image_page"] = chunk['image_page']
+    return metadata
+
+
+def embed_chunks_and_upload_to_pinecone(chunks_with_metadata, file_id: str, batch_size: int = None, progress_callback=None):
+    """
+    Embeds chunks and uploads them to the vector store with metadata.
+
+    Chunks can come from any iterable (including a generator). They are encoded
+    in batches of batch_size, and each batch is upserted in the background while
+    the next one is being encoded. progress_callback, if given, is called as
+    progress_callback(stage, count) with stage "embedded" or "upserted".
+
+    Returns a summary dict with the number of vectors written and failed.
+    """
+    batch_size = batch_size or EMBED_BATCH_SIZE
+    summary = {"file_id": file_id, "written": 0, "failed": 0, "failed_batches": []}
+
+    def report(stage, count):
+        if progress_callback:
+            progress_callback(stage, count)
+
+    def collect(pending):
+        future, first_index, count = pending
+        if future.result():
+            summary["written"] += count
+            report("upserted", count)
+        else:
+            summary["failed"] += count
+            summary["failed_batches"].append([first_index, first_index + count])
+
+    print(f"Embedding chunks for file_id: {file_id} in batches of {batch_size}")
+    pending = None
+    next_index = 0
+    # A single upload thread keeps at most one batch in flight while the next one encodes
+    with ThreadPoolExecutor(max_workers=1) as upload_executor:
+        for batch in _batched(chunks_with_metadata, batch_size):
+            first_index = next_index
+            next_index += len(batch)
+            try:
+                embeddings = encode_texts([item['text'] for item in batch])
+            except Exception as e:
+                print(f"An error occurred while embedding chunks {first_index}-{next_index - 1}: {e}")
+                summary["failed"] += len(batch)
+                summary["failed_batches"].append([first_index, next_index])
+                continue
+            report("embedded", len(batch))
+
+            vectors = [
+                {
+                    "id": chunk_vector_id(file_id, item),
+                    "values": emb.tolist(),
+                    "metadata": chunk_metadata(item, file_id),
                 }
-            }
-            for i, (chunk, emb) in enumerate(zip(chunks, embeddings))
-        ]
-        
-        if not vectors_to_upsert:
-            print("No vectors to upsert.")
-            return
-            
-        print(f"Upserting {len(vectors_to_upsert)} vectors to Pinecone...")
-        index.upsert(vectors=vectors_to_upsert)
-        print("Successfully upserted vectors to Pinecone.")
-        
-    except Exception as e:
-        print(f"An error occurred during embedding or upserting: {e}")
-
-
-def query_pinecone(query: str, top_k: int = 3, score_threshold: float = 0.55):
+                for item, emb in zip(batch, embeddings)
+            ]
+
+            if pending:
+                collect(pending)
+            pending = (upload_executor.submit(_upsert_with_retry, vectors), first_index, len(vectors))
+
+        if pending:
+            collect(pending)
+
+    get_index().flush()
+    embedding_cache = get_embedding_cache()
+    if embedding_cache is not None:
+        embedding_cache.flush()
+    if not next_index:
+        print("No vectors to upsert.")
+    print(f"Upsert summary for {file_id}: {summary['written']} written, {summary['failed']} failed.")
+    return summary
+
+
+def document_filter(file_ids):
+    """Builds a metadata filter restricting results to one or more documents."""
+    if not file_ids:
+        return None
+    if isinstance(file_ids, str):
+        file_ids = [file_ids]
+    if len(file_ids) == 1:
+        return {"file_id": {"$eq": file_ids[0]}}
+    return {"file_id": {"$in": list(file_ids)}}
+
+
+def dense_search(query_embedding, top_k: int, file_ids=None) -> list:
+    """Nearest chunks to an embedded query, scoped to the given documents."""
+    vector = np.asarray(query_embedding, dtype=np.float32).tolist()
+    return get_index().query(vector=vector, top_k=top_k, filter=document_filter(file_ids))['matches']
+
+
+def query_pinecone(query: str, top_k: int = 3, score_threshold: float = 0.55, file_ids=None, query_embedding=None):
     """
-    Embeds a query and retrieves the top_k most relevant text chunks from Pinecone,
-    filtered by a relevance score threshold.
+    Embeds a query and retrieves the top_k most relevant text chunks from the vector store,
+    filtered by a relevance score threshold. When file_ids is given (a single id or a list),
+    only chunks from those documents are searched. Pass query_embedding if the
+    query was already embedded.
     Returns context, matches, and pages with images separately.
     """
     # Embed the query
-    query_embedding = model.encode(query).tolist()
-    
-    # Query Pinecone
-    results = index.query(
-        vector=query_embedding,
-        top_k=top_k,
-        include_metadata=True
-    )
+    if query_embedding is None:
+        query_embedding = encode_texts([query])[0]
     
     # Filter matches based on the score threshold
-    matches = [match for match in results['matches'] if match['score'] >= score_threshold]
+    matches = [match for match in dense_search(query_embedding, top_k, file_ids) if match['score'] >= score_threshold]
     
     # Extract the text from the metadata of the filtered matches
     context = " ".join([match['metadata']['text'] for match in matches])
@@ -75,7 +250,7 @@ def query_pinecone(query: str, top_k: int = 3, score_threshold: float = 0.55):
     pages_with_images = {}
     for match in matches:
         if match['metadata'].get('has_images', False):
-            page_num = match['metadata']['page_number']
+            page_num = match['metadata'].get('image_page', match['metadata']['page_number'])
             score = match['score']
             # Keep track of relevance score for each page
             if page_num not in pages_with_images or score > pages_with_images[page_num]:
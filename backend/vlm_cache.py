@@ -0,0 +1,51 @@
+# backend/vlm_cache.py
+
+import json
+import os
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+VLM_CACHE_DIR = os.getenv("VLM_CACHE_DIR", "./cache/vlm")
+
+
+def _cache_path(doc_hash: str, page_number: int, prompt_version: int) -> str:
+    return os.path.join(VLM_CACHE_DIR, doc_hash, f"page_{int(page_number)}.v{prompt_version}.json")
+
+
+def get_page_analysis(doc_hash: str, page_number: int, prompt_version: int):
+    """
+    Returns the cached VLM analysis for a page of a document, or None.
+    Entries are keyed by (document content hash, page, prompt version), so
+    changing the analysis prompt invalidates them.
+    """
+    if not doc_hash:
+        return None
+    path = _cache_path(doc_hash, page_number, prompt_version)
+    try:
+        with open(path) as f:
+            return json.load(f)["analysis"]
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError) as e:
+        print(f"[VLM CACHE] Ignoring unreadable entry {path}: {e}")
+        return None
+
+
+def store_page_analysis(doc_hash: str, page_number: int, prompt_version: int, analysis: str):
+    """Stores a page's VLM analysis, replacing any previous entry."""
+    path = _cache_path(doc_hash, page_number, prompt_version)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    entry = {
+        "doc_hash": doc_hash,
+        "page_number": int(page_number),
+        "prompt_version": prompt_version,
+        "analysis": analysis,
+        "created_at": time.time(),
+    }
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(entry, f)
+    os.replace(tmp_path, path)
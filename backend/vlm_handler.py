@@ -1,22 +1,128 @@
 # backend/vlm_handler.py
 
 import os
-import google.generativeai as genai
+import io
+import json
+import threading
 from PIL import Image
 from dotenv import load_dotenv
+from document_processor import image_regions_path
 
 load_dotenv()
 
-# Configure Gemini
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-print("Available models:")
-for m in genai.list_models():
-    if 'generateContent' in m.supported_generation_methods:
-        print(f"  - {m.name}")
-# Initialize the model
-model = genai.GenerativeModel('gemini-2.5-flash')
+VLM_MODEL_NAME = os.getenv("VLM_MODEL_NAME", "gemini-2.5-flash")
 
-print("VLM configured to use Google Gemini Pro Vision")
+# The Gemini client is configured on first use; importing google.generativeai
+# is slow and listing models needs the network, so neither happens at import
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_model():
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                import google.generativeai as genai
+
+                genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+                _model = genai.GenerativeModel(VLM_MODEL_NAME)
+                print(f"VLM configured to use Google Gemini ({VLM_MODEL_NAME})")
+    return _model
+
+
+# Bump whenever the prompt in analyze_chart_comprehensively changes, so cached
+# analyses produced with the old prompt are no longer used
+CHART_ANALYSIS_PROMPT_VERSION = 1
+
+
+# Image preparation before upload: crop to the page's image regions, downscale
+# so the longest side is at most VLM_MAX_IMAGE_DIM and re-encode as WebP/JPEG
+VLM_MAX_IMAGE_DIM = int(os.getenv("VLM_MAX_IMAGE_DIM", "1600"))
+VLM_IMAGE_FORMAT = os.getenv("VLM_IMAGE_FORMAT", "webp").lower()  # "webp" or "jpeg"
+VLM_IMAGE_QUALITY = int(os.getenv("VLM_IMAGE_QUALITY", "85"))
+VLM_CROP_TO_IMAGES = os.getenv("VLM_CROP_TO_IMAGES", "1") == "1"
+# Regions covering less of the page than this are likely logos; send the whole page instead
+CROP_MIN_AREA_FRACTION = 0.05
+# Margin kept around the regions so axis labels and captions drawn as text survive
+CROP_PADDING_FRACTION = 0.03
+
+
+def _image_crop_box(image_path: str, image_size: tuple):
+    """
+    Returns the pixel box covering all image regions recorded for the page,
+    or None if the whole page should be sent.
+    """
+    try:
+        with open(image_regions_path(image_path)) as f:
+            regions = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    rects = regions.get("image_rects") or []
+    if not rects:
+        return None
+    page_width, page_height = regions["page_size"]
+    x0 = min(r[0] for r in rects)
+    y0 = min(r[1] for r in rects)
+    x1 = max(r[2] for r in rects)
+    y1 = max(r[3] for r in rects)
+    if (x1 - x0) * (y1 - y0) < CROP_MIN_AREA_FRACTION * page_width * page_height:
+        return None
+
+    pad_x = CROP_PADDING_FRACTION * page_width
+    pad_y = CROP_PADDING_FRACTION * page_height
+    scale_x = image_size[0] / page_width
+    scale_y = image_size[1] / page_height
+    return (
+        max(0, int((x0 - pad_x) * scale_x)),
+        max(0, int((y0 - pad_y) * scale_y)),
+        min(image_size[0], int((x1 + pad_x) * scale_x)),
+        min(image_size[1], int((y1 + pad_y) * scale_y)),
+    )
+
+
+def prepare_image_for_vlm(image_path: str) -> dict:
+    """
+    Returns the page image as a compact inline blob for Gemini. The prepared
+    bytes are cached next to the page render and rebuilt if the render changes.
+    """
+    image_format = "jpeg" if VLM_IMAGE_FORMAT in ("jpg", "jpeg") else "webp"
+    crop_tag = "-crop" if VLM_CROP_TO_IMAGES else ""
+    prepared_path = (
+        f"{os.path.splitext(image_path)[0]}.vlm-{VLM_MAX_IMAGE_DIM}-q{VLM_IMAGE_QUALITY}{crop_tag}.{image_format}"
+    )
+    mime_type = f"image/{image_format}"
+
+    if os.path.exists(prepared_path) and os.path.getmtime(prepared_path) >= os.path.getmtime(image_path):
+        with open(prepared_path, "rb") as f:
+            return {"mime_type": mime_type, "data": f.read()}
+
+    with Image.open(image_path) as image:
+        original_size = image.size
+        if VLM_CROP_TO_IMAGES:
+            crop_box = _image_crop_box(image_path, image.size)
+            if crop_box:
+                image = image.crop(crop_box)
+        image = image.convert("RGB")
+        image.thumbnail((VLM_MAX_IMAGE_DIM, VLM_MAX_IMAGE_DIM), Image.LANCZOS)
+
+        buffer = io.BytesIO()
+        image.save(buffer, format=image_format.upper(), quality=VLM_IMAGE_QUALITY)
+        data = buffer.getvalue()
+
+    tmp_path = prepared_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, prepared_path)
+    print(f"[VLM] Prepared image {original_size} -> {image.size}, "
+          f"{os.path.getsize(image_path) // 1024} KB -> {len(data) // 1024} KB ({image_format})")
+    return {"mime_type": mime_type, "data": data}
+
+
+def is_usable_vlm_answer(answer: str) -> bool:
+    """Filters out empty answers and the error strings returned by the VLM helpers."""
+    return bool(answer) and len(answer) > 10 and "Could not extract" not in answer and "Error" not in answer
 
 
 def is_visual_query(query: str) -> bool:
@@ -80,9 +186,9 @@ def query_image_with_vlm(image_path: str, question: str) -> str:
     
     try:
         print(f"[VLM] Loading image from: {image_path}")
-        # Load the image
-        image = Image.open(image_path)
-        print(f"[VLM] Image loaded successfully. Size: {image.size}")
+        # Load the image, cropped, downscaled and compressed for upload
+        image = prepare_image_for_vlm(image_path)
+        print(f"[VLM] Image prepared successfully. Size: {len(image['data']) // 1024} KB")
         
         # Create enhanced prompt based on question type
         if any(word in question.lower() for word in ['chart', 'graph', 'bar', 'value', 'number', 'rating', 'score', 'scale']):
@@ -110,7 +216,7 @@ def query_image_with_vlm(image_path: str, question: str) -> str:
         print(f"[VLM] Sending to Gemini...")
         
         # Generate response with CORRECT safety settings format
-        response = model.generate_content(
+        response = get_model().generate_content(
             [enhanced_prompt, image],
             safety_settings=[
                 {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
@@ -154,8 +260,8 @@ def analyze_chart_comprehensively(image_path: str, original_question: str = None
     
     try:
         print(f"[VLM COMPREHENSIVE] Loading image from: {image_path}")
-        image = Image.open(image_path)
-        print(f"[VLM COMPREHENSIVE] Image loaded. Size: {image.size}")
+        image = prepare_image_for_vlm(image_path)
+        print(f"[VLM COMPREHENSIVE] Image prepared. Size: {len(image['data']) // 1024} KB")
         
         comprehensive_prompt = """
         Analyze this chart or graph in complete detail. Please provide:
@@ -183,7 +289,7 @@ def analyze_chart_comprehensively(image_path: str, original_question: str = None
         
         print(f"[VLM COMPREHENSIVE] Sending to Gemini with comprehensive prompt...")
         
-        response = model.generate_content(
+        response = get_model().generate_content(
             [comprehensive_prompt, image],
             safety_settings=[
                 {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
@@ -217,7 +323,7 @@ def generate_image_description(image_path: str) -> str:
         return "Visual content"
     
     try:
-        image = Image.open(image_path)
+        image = prepare_image_for_vlm(image_path)
         
         prompt = """
         Briefly describe what you see in this image:
@@ -228,7 +334,7 @@ def generate_image_description(image_path: str) -> str:
         Keep it concise (2-3 sentences).
         """
         
-        response = model.generate_content([prompt, image])
+        response = get_model().generate_content([prompt, image])
         
         if response and hasattr(response, 'text') and response.text:
             return response.text.strip()
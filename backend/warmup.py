@@ -0,0 +1,139 @@
+# backend/warmup.py
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Load models and open clients in the background as soon as the app starts;
+# with 0 everything is created on the first request that needs it
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "1") == "1"
+
+# "pending" -> "warming" -> "ready" | "failed"; "ready" right away without warm-up
+state = {
+    "status": "pending" if WARMUP_ON_STARTUP else "ready",
+    "stages_ms": {},
+    "errors": {},
+}
+
+
+def _warm_embedding_model():
+    from vector_store import encode_texts
+
+    encode_texts(["warm up"])
+
+
+def _warm_vector_index():
+    from vector_store import get_index
+
+    get_index().count()
+
+
+def _warm_llm_client():
+    from llm_handler import get_client
+
+    get_client()
+
+
+def _warm_vlm_model():
+    from vlm_handler import get_model
+
+    get_model()
+
+
+def _warm_reranker():
+    import retrieval
+
+    if retrieval.RERANK_MODEL:
+        retrieval._get_reranker()
+
+
+# Stages the app cannot answer questions without; the others only degrade answers
+REQUIRED_STAGES = ("embedding_model", "vector_index")
+STAGES = (
+    ("embedding_model", _warm_embedding_model),
+    ("vector_index", _warm_vector_index),
+    ("llm_client", _warm_llm_client),
+    ("vlm_model", _warm_vlm_model),
+    ("reranker", _warm_reranker),
+)
+
+
+def warm_up():
+    """
+    Initializes every model and client handle, timing each stage. Blocking;
+    the app runs it in a worker thread while already serving /health.
+    """
+    state["status"] = "warming"
+    started = time.perf_counter()
+    for name, stage in STAGES:
+        stage_started = time.perf_counter()
+        try:
+            stage()
+        except Exception as e:
+            print(f"[WARMUP] {name} failed: {e}")
+            state["errors"][name] = str(e)
+        state["stages_ms"][name] = round((time.perf_counter() - stage_started) * 1000, 1)
+
+    failed = [name for name in REQUIRED_STAGES if name in state["errors"]]
+    state["status"] = "failed" if failed else "ready"
+    print(f"[WARMUP] {state['status']} in {time.perf_counter() - started:.2f}s; stages (ms): {state['stages_ms']}")
+
+
+def import_time_report(module: str = "main", top: int = 15) -> tuple:
+    """
+    Imports module in a fresh interpreter with -X importtime. Returns its total
+    import time in ms and the modules it imports directly that took the
+    longest, as (module, cumulative ms).
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if result.returncode != 0:
+        errors = [line for line in result.stderr.splitlines() if not line.startswith("import time:")]
+        print(errors[-1] if errors else f"import {module} failed")
+
+    # Lines look like "import time: self [us] | cumulative | <indent>module" and
+    # come children first; a direct import of a top-level module is indented by 3
+    total_ms = 0.0
+    children = []
+    pending = []
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \|( +)(\S+)", line)
+        if not match:
+            continue
+        cumulative_us, indent, name = match.groups()
+        cumulative_ms = int(cumulative_us) / 1000
+        if len(indent) == 3:
+            pending.append((name, cumulative_ms))
+        elif len(indent) == 1:
+            if name == module:
+                total_ms = cumulative_ms
+                children = pending
+            pending = []
+    return total_ms, sorted(children, key=lambda item: item[1], reverse=True)[:top]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Startup diagnostics.")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    imports_parser = subcommands.add_parser("imports", help="Show where import time goes.")
+    imports_parser.add_argument("--module", default="main")
+    imports_parser.add_argument("--top", type=int, default=15)
+    subcommands.add_parser("warmup", help="Run the warm-up stages and time them.")
+    args = parser.parse_args()
+
+    if args.command == "imports":
+        total_ms, slowest = import_time_report(args.module, args.top)
+        print(f"import {args.module}: {total_ms:.1f} ms")
+        for name, ms in slowest:
+            print(f"{ms:10.1f} ms  {name}")
+    elif args.command == "warmup":
+        warm_up()
@@ -1,40 +1,167 @@
 # backend/web_search.py
+import asyncio
 import os
-import requests
-import json
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from urllib.parse import urlparse
+
+import httpx
 from dotenv import load_dotenv
 
 load_dotenv()
 
-def search_web(query: str):
+SERPER_URL = "https://google.serper.dev/search"
+# A search that takes longer than this is dropped rather than delaying the answer
+WEB_SEARCH_TIMEOUT_SECONDS = float(os.getenv("WEB_SEARCH_TIMEOUT_SECONDS", "4"))
+WEB_SEARCH_MAX_CONNECTIONS = int(os.getenv("WEB_SEARCH_MAX_CONNECTIONS", "20"))
+WEB_SEARCH_CACHE_TTL_SECONDS = int(os.getenv("WEB_SEARCH_CACHE_TTL_SECONDS", "900"))
+WEB_SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("WEB_SEARCH_CACHE_MAX_ENTRIES", "1000"))
+# Results kept per search (at most one per domain) and their total snippet size
+WEB_SEARCH_MAX_RESULTS = int(os.getenv("WEB_SEARCH_MAX_RESULTS", "5"))
+WEB_SEARCH_MAX_CHARS = int(os.getenv("WEB_SEARCH_MAX_CHARS", "2000"))
+
+
+@dataclass(frozen=True)
+class WebResult:
+    title: str
+    link: str
+    snippet: str
+    domain: str
+
+    def source(self) -> dict:
+        """Title and link, as sent to the client."""
+        return {"title": self.title, "link": self.link}
+
+
+# One client for the whole process, so connections (and TLS sessions) to Serper are reused
+_client = None
+# normalized query -> (time stored, results), least recently used first
+_cache = OrderedDict()
+
+
+def _get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(WEB_SEARCH_TIMEOUT_SECONDS),
+            limits=httpx.Limits(
+                max_connections=WEB_SEARCH_MAX_CONNECTIONS,
+                max_keepalive_connections=WEB_SEARCH_MAX_CONNECTIONS,
+            ),
+        )
+    return _client
+
+
+async def close_client():
+    """Closes the pooled connections; called on application shutdown."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def normalize_query(query: str) -> str:
+    return re.sub(r"\s+", " ", query).strip().lower()
+
+
+def _cache_get(key: str):
+    entry = _cache.get(key)
+    if entry is None:
+        return None
+    if time.time() - entry[0] > WEB_SEARCH_CACHE_TTL_SECONDS:
+        del _cache[key]
+        return None
+    _cache.move_to_end(key)
+    return entry[1]
+
+
+def _cache_put(key: str, results):
+    _cache[key] = (time.time(), results)
+    _cache.move_to_end(key)
+    while len(_cache) > WEB_SEARCH_CACHE_MAX_ENTRIES:
+        _cache.popitem(last=False)
+
+
+def _domain(link: str) -> str:
+    domain = urlparse(link).netloc.lower()
+    return domain[4:] if domain.startswith("www.") else domain
+
+
+def _parse_results(search_results: dict) -> list:
+    """
+    Turns Serper's organic results into WebResults: one per domain, at most
+    WEB_SEARCH_MAX_RESULTS, with snippets trimmed to WEB_SEARCH_MAX_CHARS in total.
+    """
+    results = []
+    seen_domains = set()
+    chars_left = WEB_SEARCH_MAX_CHARS
+    for item in search_results.get("organic", []):
+        if len(results) >= WEB_SEARCH_MAX_RESULTS or chars_left <= 0:
+            break
+        link = item.get("link")
+        domain = _domain(link) if link else ""
+        if not domain or domain in seen_domains:
+            continue
+        seen_domains.add(domain)
+        snippet = (item.get("snippet") or "")[:chars_left]
+        chars_left -= len(snippet)
+        results.append(WebResult(title=item.get("title") or domain, link=link, snippet=snippet, domain=domain))
+    return results
+
+
+def format_web_results(results: list) -> str:
+    """Formats WebResults for the LLM prompt."""
+    return "\n\n".join(
+        f"[{i}] {result.title} ({result.domain})\n{result.snippet}"
+        for i, result in enumerate(results, start=1)
+    )
+
+
+async def search_web(query: str):
     """
-    Performs a web search using the Serper API.
+    Performs a web search using the Serper API and returns a list of WebResults,
+    or None if the search failed. Results are cached per normalized query for
+    WEB_SEARCH_CACHE_TTL_SECONDS.
     """
     api_key = os.getenv("SERPER_API_KEY")
     if not api_key:
         print("SERPER_API_KEY not found in .env file.")
         return None
 
-    url = "https://google.serper.dev/search"
-    payload = json.dumps({"q": query})
+    key = normalize_query(query)
+    cached = _cache_get(key)
+    if cached is not None:
+        print(f"[WEB] Cache hit for '{key[:60]}'")
+        return cached
+
     headers = {
         'X-API-KEY': api_key,
         'Content-Type': 'application/json'
     }
 
     try:
-        response = requests.post(url, headers=headers, data=payload)
+        started = time.perf_counter()
+        # httpx applies its timeout to each phase (connect, write, each read), so a
+        # slow response could take several times as long; this bounds the whole call
+        response = await asyncio.wait_for(
+            _get_client().post(SERPER_URL, headers=headers, json={"q": query}),
+            timeout=WEB_SEARCH_TIMEOUT_SECONDS,
+        )
         response.raise_for_status()  # Raise an exception for bad status codes
-        search_results = response.json()
-        
-        # Let's format the results to be more useful for the LLM
-        formatted_results = []
-        if search_results.get("organic"):
-            for result in search_results["organic"]:
-                formatted_results.append(f"Title: {result.get('title', 'N/A')}\nLink: {result.get('link', 'N/A')}\nSnippet: {result.get('snippet', 'N/A')}")
-        
-        return "\n\n---\n\n".join(formatted_results)
-
-    except requests.exceptions.RequestException as e:
+        results = _parse_results(response.json())
+        print(f"[WEB] Search took {(time.perf_counter() - started) * 1000:.0f} ms, kept {len(results)} results")
+        _cache_put(key, results)
+        return results
+
+    except (httpx.TimeoutException, asyncio.TimeoutError):
+        print(f"Web search timed out after {WEB_SEARCH_TIMEOUT_SECONDS}s")
+        return None
+    except httpx.HTTPError as e:
         print(f"Error during web search: {e}")
-        return None
\ No newline at end of file
+        return None
+    except ValueError as e:
+        # Not JSON, e.g. an HTML error page from a gateway
+        print(f"Web search returned an unreadable response: {e}")
+        return None
@@ -3,6 +3,26 @@
 
 import { useState, useRef, useEffect } from "react";
 
+// Typing effect for streamed answers. The backend sends coalesced frames as fast
+// as the model produces them; the client reveals the text progressively and
+// speeds up when it falls behind.
+const TYPING_INTERVAL_MS = 20;
+const TYPING_MIN_STEP = 2;
+const TYPING_CATCH_UP_FRAMES = 15;
+
+// Chat history and the active document are kept server-side per session;
+// the id is stored locally so a reload continues the same conversation
+const SESSION_STORAGE_KEY = "veritasSessionId";
+
+const getSessionId = () => {
+  let sessionId = localStorage.getItem(SESSION_STORAGE_KEY);
+  if (!sessionId) {
+    sessionId = crypto.randomUUID().replace(/-/g, "");
+    localStorage.setItem(SESSION_STORAGE_KEY, sessionId);
+  }
+  return sessionId;
+};
+
 export default function Home() {
   const [messages, setMessages] = useState([
     { role: "bot", content: "Hello! Upload a document and I'll answer your questions about it." }
@@ -67,14 +87,19 @@ export default function Home() {
       const response = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/api/upload`, {
 
         method: "POST",
+        headers: { "X-Session-Id": getSessionId() },
         body: formData,
       });
 
       if (!response.ok) throw new Error("File upload failed");
 
       const result = await response.json();
-      const successMessage = { role: "bot", content: result.message };
-      setMessages(prevMessages => [...prevMessages.slice(0, -1), successMessage]);
+      const receivedMessage = { role: "bot", content: result.message, jobId: result.job_id };
+      setMessages(prevMessages => [...prevMessages.slice(0, -1), receivedMessage]);
+
+      if (result.job_id) {
+        followIngestionJob(result.job_id);
+      }
 
     } catch (error) {
       console.error("Upload error:", error);
@@ -83,17 +108,46 @@ export default function Home() {
     }
   };
 
+  // Follow background ingestion progress and keep the upload message up to date
+  const followIngestionJob = (jobId) => {
+    const events = new EventSource(`${process.env.NEXT_PUBLIC_API_URL}/api/jobs/${jobId}/events`);
+
+    events.onmessage = (event) => {
+      if (event.data === '[DONE]') {
+        events.close();
+        return;
+      }
+
+      const job = JSON.parse(event.data);
+      let content = job.message;
+      if (job.status === 'parsing' && job.pages_total) {
+        content = `Parsing "${job.filename}"... (${job.pages_total} pages)`;
+      } else if (job.status === 'embedding') {
+        content = `Embedding "${job.filename}"... ${job.vectors_upserted}/${job.chunks_total} chunks stored`;
+      }
+
+      setMessages(prevMessages => prevMessages.map(msg =>
+        msg.jobId === jobId ? { ...msg, content } : msg
+      ));
+    };
+
+    events.onerror = () => {
+      events.close();
+    };
+  };
+
   const handleSend = async () => {
     if (input.trim()) {
       const userMessage = { role: "user", content: input };
       setMessages(prev => [...prev, userMessage]);
       setInput("");
       setIsStreaming(true);
+      let typingTimer = null;
       
       try {
         const response = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/api/upload`, {
           method: "POST", 
-          headers: { "Content-Type": "application/json" },
+          headers: { "Content-Type": "application/json", "X-Session-Id": getSessionId() },
           body: JSON.stringify({ 
             message: input,
             search_web: isWebSearchEnabled 
@@ -114,6 +168,7 @@ export default function Home() {
           citations: [],
           used_vlm: false,
           vlm_pages: [],
+          web_sources: [],
           response_type: null
         };
         
@@ -122,14 +177,34 @@ export default function Home() {
         let accumulatedContent = "";
         let buffer = "";
         let firstCitationSet = false;
-        
-        while (true) {
-          const { value, done } = await reader.read();
-          if (done) {
+        let displayedLength = 0;
+        let streamFinished = false;
+
+        typingTimer = setInterval(() => {
+          const backlog = accumulatedContent.length - displayedLength;
+          if (backlog > 0) {
+            displayedLength += Math.max(TYPING_MIN_STEP, Math.ceil(backlog / TYPING_CATCH_UP_FRAMES));
+            botMessageData.content = accumulatedContent.slice(0, displayedLength);
+
+            setMessages(prev => {
+              const newMessages = [...prev];
+              newMessages[botMessageIndex] = { ...botMessageData };
+              return newMessages;
+            });
+          } else if (streamFinished) {
+            clearInterval(typingTimer);
             setIsStreaming(false);
             setMessages(prev => prev.map((msg, idx) => 
               idx === botMessageIndex ? { ...msg, isStreaming: false } : msg
             ));
+          }
+        }, TYPING_INTERVAL_MS);
+        
+        while (true) {
+          const { value, done } = await reader.read();
+          if (done) {
+            // The typing timer finalizes the message once it has caught up
+            streamFinished = true;
             break;
           }
 
@@ -158,6 +233,7 @@ export default function Home() {
                     citations: parsed.citations || [],
                     used_vlm: parsed.used_vlm || false,
                     vlm_pages: parsed.vlm_pages || [],
+                    web_sources: parsed.web_sources || [],
                     response_type: parsed.response_type
                   };
                   
@@ -175,15 +251,8 @@ export default function Home() {
                   }
                   
                 } else if (parsed.type === 'content') {
-                  // Append content
+                  // Append content; the typing timer renders it
                   accumulatedContent += parsed.content;
-                  botMessageData.content = accumulatedContent;
-                  
-                  setMessages(prev => {
-                    const newMessages = [...prev];
-                    newMessages[botMessageIndex] = { ...botMessageData };
-                    return newMessages;
-                  });
                 }
               } catch (e) {
                 console.error('Parse error:', e);
@@ -194,6 +263,7 @@ export default function Home() {
         
       } catch (error) {
         console.error("Fetch error:", error);
+        clearInterval(typingTimer);
         setIsStreaming(false);
         const errorMessage = { role: "bot", content: "Sorry, I'm having trouble connecting." };
         setMessages(prev => [...prev, errorMessage]);
@@ -365,6 +435,20 @@ export default function Home() {
                     )}
                   </div>
                 )}
+
+                {/* Web Sources */}
+                {msg.role === 'bot' && msg.web_sources && msg.web_sources.length > 0 && (
+                  <div className="flex items-center gap-2 px-2 flex-wrap">
+                    <span className="text-xs text-gray-500 font-medium">Web Sources:</span>
+                    <div className="flex flex-wrap gap-1">
+                      {msg.web_sources.map((source, idx) => (
+                        <a key={idx} href={source.link} target="_blank" rel="noopener noreferrer" className="inline-flex items-center px-2 py-1 text-xs font-medium bg-green-100 text-green-700 rounded-full hover:bg-green-200 transition-colors max-w-xs truncate" title={source.link}>
+                          {source.title}
+                        </a>
+                      ))}
+                    </div>
+                  </div>
+                )}
               </div>
               {msg.role === 'user' && (
                 <div className="w-8 h-8 rounded-full bg-gray-700 flex items-center justify-center text-white font-bold flex-shrink-0">U</div>